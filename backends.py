@@ -0,0 +1,227 @@
+import ROOT
+import functools
+import math
+import multiprocessing
+import os
+import time
+import booking
+import columnar
+import cpplib
+import fillspec
+import inputs
+import profiling
+import utils
+
+## A fill task is one input (MC sample or merged data) and the histograms still missing for it:
+## {"label": sample name, "inputs": [file paths], "files": [files actually read, the inputs or their skim],
+##  "cuts": sample cuts, "weighted": bool, "variables": [1D variable, ...], "nd_variables": [config.nd_vars entry, ...],
+##  "range": [begin, end) entry range or None, "file_entries": [entries per file], "entries": total entries of the files}
+
+RDF_CALLBACKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rdf_callbacks.C")
+
+def create_RDF(config_file, task, rdf_class=None):
+    print(f"Creating RDF for sample {task['label']}")
+    with profiling.stage("open_rdf", sample=task["label"]):
+        if task["range"] is None:
+            df = (rdf_class or ROOT.RDataFrame)("Events", task["files"])
+        else:
+            df = ROOT.RDataFrame(dataset_spec(task))
+
+    # Apply MC weights, as double so that the weight variations can be declared as RVecD
+    if task["weighted"]:
+        df = df.Define("final_weight", f"double({config_file.weights})")
+        df = booking.apply_variations(df, config_file)
+    return df
+
+def dataset_spec(task):
+    """Dataset of one fill task restricted to its global entry range, which unlike Range() works with implicit MT."""
+    spec = ROOT.RDF.Experimental.RDatasetSpec()
+    spec.AddSample(ROOT.RDF.Experimental.RSample(task["label"], "Events", task["files"]))
+    spec.WithGlobalRange(ROOT.RDF.Experimental.RDatasetSpec.REntryRange(*task["range"]))
+    return spec
+
+def run_local(config_file, tasks):
+    """Fill all tasks in this process with one RunGraphs call.
+
+    Every backend returns ({(plot name, label): TH1}, {label: cut-flow report}, number of event loops run).
+    """
+    RDF_dict = {}
+    booked = {}
+    varied = {}
+    reports = {}
+    for task in tasks:
+        df = create_RDF(config_file, task)
+        RDF_dict[task["label"]] = df
+        task_booked, task_varied, reports[task["label"]] = booking.book_histograms(config_file, df, task)
+        booked.update(task_booked)
+        varied.update(task_varied)
+
+    # Entries read per input for the progress report, and the time to the first entry, which is the JIT of all graphs
+    declare_callbacks()
+    total = sum(inputs.selected_entries(task) for task in tasks)
+    every = max(1000, min(100000, total // 100))
+    counts = {}
+    for label, df in RDF_dict.items():
+        counts[label] = df.Count()
+        ROOT.plottools.RegisterProgress(counts[label], every)
+        if profiling.enabled():
+            ROOT.plottools.RegisterFirstEntry(counts[label])
+    if profiling.enabled():
+        ROOT.plottools.MarkLoopStart()
+        bytes_before = ROOT.TFile.GetFileBytesRead()
+
+    # Run all event loops together, each input is read once
+    print(f"Running event loops for {len(booked)} histograms...")
+    with profiling.stage("event_loop"):
+        ROOT.plottools.StartProgress(total)
+        ROOT.RDF.RunGraphs(list(booked.values()) + list(reports.values()) + list(counts.values()))
+        ROOT.plottools.EndProgress(sum(count.GetValue() for count in counts.values()))
+    nloops = utils.report_event_loops(RDF_dict)
+
+    if profiling.enabled():
+        profiling.record("jit_graphs", ROOT.plottools.SecondsToFirstEntry())
+        profiling.set_total("bytes_read", ROOT.TFile.GetFileBytesRead() - bytes_before)
+        for task in tasks:
+            # per-file attribution is not possible within one RunGraphs call, estimate it from the compressed size
+            # of the branches read, scaled to the fraction of the entries in the entry range
+            fraction = inputs.selected_entries(task) / task["entries"] if task["entries"] else 0
+            estimate = utils.branch_zip_bytes(task["files"], fillspec.task_expressions(config_file, task)) * fraction
+            profiling.set_input(task["label"], events=counts[task["label"]].GetValue(), bytes_read_estimate=estimate)
+    return booking.collect_results(booked, varied), reports, nloops
+
+def declare_callbacks():
+    if not hasattr(ROOT, "plottools") or not hasattr(ROOT.plottools, "MarkLoopStart"):
+        ROOT.gInterpreter.Declare(f'#include "{RDF_CALLBACKS}"')
+
+def run_dask(config_file, tasks):
+    """Fill all tasks with ROOT's distributed RDataFrame on a Dask cluster, partial results are merged by ROOT."""
+    from dask.distributed import Client, LocalCluster
+    if any(task["range"] for task in tasks):
+        raise ValueError("Entry ranges are not supported by the dask backend, use the local or multiprocessing backend")
+    Distributed = ROOT.RDF.Experimental.Distributed
+
+    cluster = None
+    if config_file.dask_scheduler:
+        client = Client(config_file.dask_scheduler)
+    else:
+        cluster = LocalCluster(n_workers=config_file.dist_nworkers, threads_per_worker=1, processes=True)
+        client = Client(cluster)
+    print(f"[INFO] Dask dashboard: {client.dashboard_link}")
+
+    # the Define/Filter strings may call the C++ helpers, every worker has to declare them
+    # remote workers may not see the local build directory, so they JIT the source
+    cpp_helpers = cpplib.CPP_HELPERS
+    def declare_helpers():
+        ROOT.gInterpreter.ProcessLine(f'#include "{cpp_helpers}"')
+    Distributed.initialize(declare_helpers)
+
+    rdf_class = functools.partial(Distributed.Dask.RDataFrame, daskclient=client, npartitions=config_file.dist_npartitions)
+    booked = {}
+    varied = {}
+    for task in tasks:
+        df = create_RDF(config_file, task, rdf_class=rdf_class)
+        # cut-flow reports are not supported by the distributed backends
+        task_booked, task_varied, _ = booking.book_histograms(config_file, df, task, with_report=False, variations_for=Distributed.VariationsFor)
+        booked.update(task_booked)
+        varied.update(task_varied)
+
+    print(f"Running distributed event loops for {len(booked)} histograms...")
+    # the partitions run on the cluster, only the overall rate is known here (per partition on the dashboard)
+    total = sum(task["entries"] for task in tasks)
+    start_time = time.time()
+    columnar.print_progress(0, total, 0)
+    Distributed.RunGraphs(list(booked.values()))
+    columnar.print_progress(total, total, time.time() - start_time, final=True)
+    histos = booking.collect_results(booked, varied)
+    client.close()
+    if cluster is not None:
+        cluster.close()
+    # one distributed event loop per input, split over the partitions
+    return histos, {}, len(tasks)
+
+def _init_partition_worker():
+    # single-threaded worker, the partitions are the parallelism
+    ROOT.gROOT.SetBatch(True)
+    cpplib.load()
+
+def _fill_partition(config_file, partition):
+    task, first, last = partition
+    # the partition is already inside the entry range of the task, read through the same global range dataset spec
+    df = create_RDF(config_file, dict(task, range=(first, last)))
+    booked, varied, _ = booking.book_histograms(config_file, df, task, with_report=False)
+    ROOT.RDF.RunGraphs(list(booked.values()))
+    return booking.collect_results(booked, varied), last - first
+
+def run_multiprocessing(config_file, tasks):
+    """Split every task into entry ranges, fill them in a local process pool and merge the partial histograms."""
+    partitions = []
+    for task in tasks:
+        begin, end = task["range"] or (0, task["entries"])
+        end = max(begin, min(end, task["entries"]))
+        step = max(1, math.ceil((end - begin) / config_file.dist_npartitions))
+        for first in range(begin, max(end, begin + 1), step):
+            partitions.append((task, first, min(first + step, end)))
+    print(f"[INFO] Filling {len(partitions)} partitions with {config_file.dist_nworkers} worker processes")
+
+    merged = {}
+    # progress of the finished partitions, same report as the other engines
+    total = sum(last - first for _, first, last in partitions)
+    done = 0
+    start_time = time.time()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(config_file.dist_nworkers, initializer=_init_partition_worker) as pool:
+        for partial, nentries in pool.imap_unordered(functools.partial(_fill_partition, config_file), partitions):
+            for key, hist in partial.items():
+                if key in merged:
+                    merged[key].Add(hist)
+                else:
+                    merged[key] = hist
+            done += nentries
+            columnar.print_progress(done, total, time.time() - start_time)
+    columnar.print_progress(done, total, time.time() - start_time, final=True)
+    # one single-threaded event loop per partition
+    return merged, {}, len(partitions)
+
+## Rough event loop memory of a fill task, used to split the tasks into batches under config.memory_budget_mb:
+## the dataframe with its JIT-compiled graph, a tree reader per processing slot, and every histogram
+## (sum of weights and sum of squared weights per cell) once per slot plus the merged result.
+DATAFRAME_MB = 50
+SLOT_READER_MB = 20
+
+def histogram_cells(spec):
+    """Number of cells including the flow bins of a 1D variable or a config.nd_vars entry."""
+    if isinstance(spec, dict):
+        return math.prod(len(utils.axis_edges(axis)) + 1 for axis in spec["axes"])
+    nbins = len(spec[3]) - 1 if isinstance(spec[3], list) else spec[3]
+    return nbins + 2
+
+def task_memory_mb(config_file, task, nslots):
+    copies = 1 + (len(fillspec.variations(config_file)) if task["weighted"] else 0)
+    cells = sum(histogram_cells(spec) for spec in task["variables"] + task["nd_variables"])
+    return DATAFRAME_MB + SLOT_READER_MB * nslots + cells * 16 * copies * (nslots + 1) / 1e6
+
+def memory_batches(config_file, tasks, budget_mb):
+    """Split the tasks into consecutive batches whose estimated memory fits the budget, a larger single task gets its own batch."""
+    if not budget_mb:
+        return [tasks] if tasks else []
+    nslots = max(1, ROOT.ROOT.GetThreadPoolSize())
+    batches = []
+    batch, batch_mb = [], 0.0
+    for task in tasks:
+        needed = task_memory_mb(config_file, task, nslots)
+        if batch and batch_mb + needed > budget_mb:
+            batches.append(batch)
+            batch, batch_mb = [], 0.0
+        if needed > budget_mb:
+            print(f"[WARNING] {task['label']} alone needs about {needed:.0f} MB, more than the memory budget of {budget_mb} MB")
+        batch.append(task)
+        batch_mb += needed
+    if batch:
+        batches.append(batch)
+    return batches
+
+BACKENDS = {
+    "local": run_local,
+    "dask": run_dask,
+    "multiprocessing": run_multiprocessing,
+}
@@ -0,0 +1,183 @@
+import ROOT
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import config
+import histstore
+import makePlotsCMS
+import render
+
+ROOT.gROOT.SetBatch(True)
+
+## Synthetic NanoHc-like "Events" trees with the branches used by config.Config.vars and weights
+SCALAR_BRANCHES = {
+    "H_mass": "float(gRandom->Landau(125, 15))",
+    "H4e_mass": "float(gRandom->Landau(125, 15))",
+    "H4mu_mass": "float(gRandom->Landau(125, 15))",
+    "H2e2mu_mass": "float(gRandom->Landau(125, 15))",
+    "ZZ_mass": "float(gRandom->Landau(200, 40))",
+    "ZZ4e_mass": "float(gRandom->Landau(200, 40))",
+    "ZZ4mu_mass": "float(gRandom->Landau(200, 40))",
+    "ZZ2e2mu_mass": "float(gRandom->Landau(200, 40))",
+    "genWeight": "float(gRandom->Gaus(1, 0.1))",
+    "xsecWeight": "float(0.01)",
+    "lumiwgt": "float(1)",
+    "puWeight": "float(gRandom->Gaus(1, 0.05))",
+    "muEffWeight": "float(gRandom->Gaus(1, 0.02))",
+    "elEffWeight": "float(gRandom->Gaus(1, 0.02))",
+}
+for i in range(1, 5):
+    SCALAR_BRANCHES[f"lep{i}_eta"] = "float(gRandom->Uniform(-2.5, 2.5))"
+    SCALAR_BRANCHES[f"lep{i}_phi"] = "float(gRandom->Uniform(-TMath::Pi(), TMath::Pi()))"
+JET_BRANCHES = {
+    "jet_pt": "gRandom->Exp(50)",
+    "jet_eta": "gRandom->Uniform(-2.5, 2.5)",
+    "jet_mass": "gRandom->Exp(10)",
+    "jet_bdisc": "gRandom->Uniform(0, 1)",
+    "jet_cvbdisc": "gRandom->Uniform(0, 1)",
+    "jet_cvldisc": "gRandom->Uniform(0, 1)",
+}
+
+def make_synthetic_tree(filename, nevents):
+    # generated single-threaded, gRandom is not thread safe
+    df = ROOT.RDataFrame(nevents).Define("njet", "int(gRandom->Poisson(2))")
+    for branch, expression in SCALAR_BRANCHES.items():
+        df = df.Define(branch, expression)
+    for branch, expression in JET_BRANCHES.items():
+        df = df.Define(branch, f"ROOT::RVecF v(njet); for (auto &x : v) x = {expression}; return v;")
+    df.Snapshot("Events", filename, ["njet"] + list(SCALAR_BRANCHES) + list(JET_BRANCHES))
+
+def make_inputs(workdir, nsamples, nevents, with_data):
+    """Write nsamples MC trees (and the data files of the config) under workdir, returns a ready Config."""
+    config_file = config.Config()
+    config_file.base_dir = os.path.join(workdir, "mc")
+    config_file.output_plots_dir = os.path.join(workdir, "plots")
+    config_file.histogram_store = os.path.join(workdir, "plots", "histograms.root")
+    # nothing outside workdir, a cache or skims of an earlier run must not be picked up
+    config_file.cache_dir = os.path.join(workdir, "cache")
+    config_file.skim_dir = os.path.join(workdir, "skims")
+    os.makedirs(config_file.base_dir, exist_ok=True)
+    for i in range(nsamples):
+        filename = f"sample{i}_final_merged.root"
+        path = os.path.join(config_file.base_dir, filename)
+        if not os.path.exists(path):
+            make_synthetic_tree(path, nevents)
+        config_file.add_sample(name=f"sample{i}", root_file=filename, cuts=1)
+    data_dir = None
+    if with_data:
+        data_dir = os.path.join(workdir, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        for filename in config_file.get_data_filenames():
+            path = os.path.join(data_dir, filename)
+            if not os.path.exists(path):
+                make_synthetic_tree(path, nevents)
+    return config_file, data_dir
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def time_startup():
+    # fresh interpreter: Python startup, ROOT import, implicit MT and loading the compiled C++ helpers
+    start = time.time()
+    subprocess.run([sys.executable, "-c", "import makePlotsCMS; makePlotsCMS.setup_fill_runtime()"], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.time() - start
+
+def run_benchmark(args):
+    report = {"samples": args.samples, "events_per_file": args.events, "data": args.data}
+    report["startup_s"] = time_startup()
+
+    # tiny copies of the inputs: the fill time is then dominated by booking and JIT
+    jit_config, jit_data = make_inputs(os.path.join(args.workdir, "jit"), args.samples, 1, args.data)
+    config_file, data_dir = make_inputs(os.path.join(args.workdir, f"events_{args.events}"), args.samples, args.events, args.data)
+
+    makePlotsCMS.setup_fill_runtime()
+    # rebuild: a previous benchmark run must not be reused through the run manifest
+    fill_args = argparse.Namespace(data=jit_data, backend=args.backend, no_cache=True, no_skim=True, rebuild=True, max_events=None, entry_range=None, memory_budget=None)
+    start = time.time()
+    makePlotsCMS.fill_histograms(jit_config, fill_args, jit_config.histogram_store)
+    report["jit_s"] = time.time() - start
+
+    fill_args.data = data_dir
+    start = time.time()
+    fill_summary = makePlotsCMS.fill_histograms(config_file, fill_args, config_file.histogram_store)
+    report["fill_s"] = time.time() - start
+    report["fill_peak_rss_mb"] = peak_rss_mb()
+    report["event_loops"] = fill_summary["event_loops"]
+    report["histograms"] = fill_summary["histograms"]
+    nfiles = args.samples + (len(config_file.get_data_filenames()) if args.data else 0)
+    report["events"] = nfiles * args.events
+    report["events_per_s"] = report["events"] / report["fill_s"]
+
+    start = time.time()
+    render.render_plots(config_file, config_file.histogram_store, "stack", jobs=args.render_jobs, rebuild=True)
+    report["render_s"] = time.time() - start
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def bin_arrays(hist):
+    ncells = hist.GetNbinsX() + 2
+    return [hist.GetBinContent(i) for i in range(ncells)], [hist.GetBinError(i) for i in range(ncells)]
+
+def compare_engines(args, rtol=1e-6):
+    """Fill the same synthetic inputs with the ROOT and the uproot engine and compare every histogram bin by bin."""
+    config_file, data_dir = make_inputs(os.path.join(args.workdir, f"events_{args.events}"), args.samples, args.events, args.data)
+    # exercise the expression translation: cuts, a function call, variable binning and both kinds of variations
+    config_file.cut_stages = [["mass window", "H_mass > 90 && !(ZZ_mass > 500)"]]
+    config_file.cuts = "std::abs(lep1_eta) < 2.4 || lep2_eta > 0"
+    config_file.vars.append(["deltaR(lep1_eta, lep2_eta, lep1_phi, lep2_phi)", "dR_lep1_lep_2", "#DeltaR(lep1,lep2)", [0, 0.5, 1, 2, 3, 4, 6]])
+    config_file.weight_variations = {"scale": {"up": "1.1", "down": "1. / 1.1"}}
+    config_file.column_variations = {"H_mass_scale": ["H_mass", {"up": "H_mass * 1.01", "down": "H_mass * 0.99"}]}
+    fill_args = argparse.Namespace(data=data_dir, backend="local", no_cache=True, no_skim=True, rebuild=True, max_events=None, entry_range=None, memory_budget=None)
+    stores = {engine: os.path.join(config_file.output_plots_dir, f"histograms_{engine}.root") for engine in ("root", "uproot")}
+
+    report = {}
+    start = time.time()
+    makePlotsCMS.fill_histograms_columnar(config_file, fill_args, stores["uproot"])
+    report["uproot_fill_s"] = time.time() - start
+    start = time.time()
+    makePlotsCMS.setup_fill_runtime()
+    makePlotsCMS.fill_histograms(config_file, fill_args, stores["root"])
+    report["root_fill_s"] = time.time() - start
+
+    compared = 0
+    mismatches = []
+    for variable in config_file.vars:
+        root_histos = histstore.read_variable(stores["root"], variable[1])
+        uproot_histos = histstore.read_variable(stores["uproot"], variable[1])
+        if set(root_histos) != set(uproot_histos):
+            mismatches.append(f"{variable[1]}: samples differ {sorted(set(root_histos) ^ set(uproot_histos))}")
+        for label in sorted(set(root_histos) & set(uproot_histos)):
+            compared += 1
+            for what, expected, actual in zip(("content", "error"), bin_arrays(root_histos[label]), bin_arrays(uproot_histos[label])):
+                for i, (a, b) in enumerate(zip(expected, actual)):
+                    if abs(a - b) > rtol * max(abs(a), abs(b), 1e-12):
+                        mismatches.append(f"{variable[1]}/{label} bin {i} {what}: root {a} uproot {b}")
+    report["histograms_compared"] = compared
+    report["mismatches"] = len(mismatches)
+    for line in mismatches[:20]:
+        print(f"[WARNING] {line}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fill and render on synthetic NanoHc-like trees")
+    parser.add_argument('-n', '--events', type=int, help='Events per synthetic file', default=100000)
+    parser.add_argument('-s', '--samples', type=int, help='Number of synthetic MC samples', default=4)
+    parser.add_argument('-d', '--data', action='store_true', help='Also generate and fill synthetic data files')
+    parser.add_argument('-b', '--backend', type=str, help='Fill backend', default='local')
+    parser.add_argument('-j', '--render-jobs', type=int, help='Worker processes for rendering', default=1)
+    parser.add_argument('-w', '--workdir', type=str, help='Directory for the synthetic inputs and outputs', default='bench_work')
+    parser.add_argument('--compare-engines', action='store_true', help='Check that the uproot engine reproduces the ROOT engine bin by bin instead of timing')
+    parser.add_argument('-o', '--output', type=str, help='JSON report', default='bench_report.json')
+    args = parser.parse_args()
+
+    report = compare_engines(args) if args.compare_engines else run_benchmark(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"{'stage':<20}{'value':>14}")
+    for key, value in report.items():
+        print(f"{key:<20}{value:>14.3f}" if isinstance(value, float) else f"{key:<20}{str(value):>14}")
+    print(f"[INFO] Report written to {args.output}")
@@ -0,0 +1,99 @@
+import ROOT
+import fillspec
+import histstore
+import utils
+
+def build_sample_graph(df, config_file, sample_cuts=None):
+    """Apply the named cut stages, the global cut and the sample cut once, the returned node is shared by all variables."""
+    node = df
+    for stage_name, expression in config_file.cut_stages:
+        node = node.Filter(expression, stage_name)
+    node = node.Filter(str(config_file.cuts), "global cuts")
+    if sample_cuts is not None and str(sample_cuts) != "1":
+        node = node.Filter(str(sample_cuts), "sample cuts")
+    return node
+
+def define_variables(node, expressions):
+    """Define every distinct expression once, return the new node and {expression: column name}."""
+    columns = {}
+    for expression in expressions:
+        if expression in columns:
+            continue
+        column = f"plotvar_{len(columns)}"
+        node = node.Define(column, expression)
+        columns[expression] = column
+    return node, columns
+
+def apply_variations(df, config_file):
+    """Register the weight and column variations with Vary, they are filled in the same event loop as the nominal."""
+    for name, tags in config_file.weight_variations.items():
+        expressions = ", ".join(f"final_weight * ({tags[tag]})" for tag in tags)
+        df = df.Vary("final_weight", f"ROOT::RVecD{{{expressions}}}", list(tags), name)
+    for name, (column, tags) in config_file.column_variations.items():
+        column_type = df.GetColumnType(column)
+        expressions = ", ".join(f"static_cast<{column_type}>({tags[tag]})" for tag in tags)
+        df = df.Vary(column, f"ROOT::RVec<{column_type}>{{{expressions}}}", list(tags), name)
+    return df
+
+def book_histograms(config_file, df, task, with_report=True, variations_for=None):
+    """Book every missing histogram of one fill task on df.
+
+    Returns ({(plot name, label): RResultPtr}, {(plot name, variation label): (RResultMap, variation key)}, cut-flow report or None).
+    """
+    node = build_sample_graph(df, config_file, task["cuts"])
+    report = node.Report() if with_report else None
+    node, columns = define_variables(node, [variable[0] for variable in task["variables"]] + [axis[0] for spec in task["nd_variables"] for axis in spec["axes"]])
+    task_variations = fillspec.variations(config_file) if task["weighted"] else []
+    variations_for = variations_for or ROOT.RDF.Experimental.VariationsFor
+    booked = {}
+    varied = {}
+    for variable in task["variables"]:
+        model = utils.histo1d_model(f"hist_{task['label']}_{variable[0]}", variable)
+        if task["weighted"]:
+            result = node.Histo1D(model, columns[variable[0]], "final_weight")
+        else:
+            result = node.Histo1D(model, columns[variable[0]])
+        booked[(variable[1], task["label"])] = result
+    for spec in task["nd_variables"]:
+        model = utils.histond_model(f"hist_{task['label']}_{spec['name']}", spec)
+        axis_columns = [columns[axis[0]] for axis in spec["axes"]] + (["final_weight"] if task["weighted"] else [])
+        if len(spec["axes"]) == 2:
+            result = node.Histo2D(model, *axis_columns)
+        elif len(spec["axes"]) == 3:
+            result = node.Histo3D(model, *axis_columns)
+        else:
+            result = node.HistoND(model, axis_columns)
+        booked[(spec["name"], task["label"])] = result
+    if task_variations:
+        for (plot_name, _), result in list(booked.items()):
+            # must be requested before the event loop runs
+            result_map = variations_for(result)
+            for key, suffix in task_variations:
+                varied[(plot_name, fillspec.variation_label(task["label"], suffix))] = (result_map, key)
+    return booked, varied, report
+
+def collect_results(booked, varied):
+    """Detached copies of every nominal and varied histogram once the event loop has run."""
+    histos = {key: detach(result.GetValue()) for key, result in booked.items()}
+    for key, (result_map, variation_key) in varied.items():
+        histos[key] = detach(result_map[variation_key])
+    return histos
+
+def detach(hist):
+    """Copy a filled histogram out of its RResultPtr so it outlives the computation graph."""
+    return histstore.detach(hist.Clone())
+
+def write_cutflow(reports, filename, append=False, post_skim=()):
+    """Print the cut-flow of every sample and save it as a text table, reports = {sample: RResultPtr<RCutFlowReport>}.
+
+    Samples in post_skim were read from a skim, their efficiencies are relative to the skimmed events.
+    """
+    lines = []
+    for sample, report in reports.items():
+        lines.append(f"{sample} (post-skim, efficiencies relative to the skimmed events)" if sample in post_skim else f"{sample}")
+        for cut in report.GetValue():
+            lines.append(f"  {cut.GetName():<30} pass={cut.GetPass():<12} all={cut.GetAll():<12} eff={cut.GetEff():6.2f} %")
+    print("[INFO] Cut-flow:")
+    print("\n".join(lines))
+    with open(filename, "a" if append else "w") as f:
+        f.write("\n".join(lines) + "\n")
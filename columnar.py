@@ -0,0 +1,282 @@
+import ast
+import functools
+import re
+import sys
+import time
+import numpy as np
+import fillspec
+import histarrays
+import inputs
+import profiling
+
+## Columnar fill engine: the referenced branches are read in chunks with uproot and the Config expressions are
+## evaluated on NumPy arrays, without importing ROOT at all (no implicit MT, no Cling JIT, no C++ helpers). The histograms follow
+## ROOT's binning (bin 0 underflow, nbins + 1 overflow) so the store is interchangeable with the ROOT engine.
+## Expressions are limited to scalar branches, arithmetic, comparisons, logical operators and the functions below.
+
+def _deltaR(eta1, eta2, phi1, phi2):
+    # same as deltaR in cpp_functions.C
+    eta1, eta2, phi1, phi2 = (np.asarray(x, dtype=np.float64) for x in (eta1, eta2, phi1, phi2))
+    dphi = np.mod(phi1 - phi2 + np.pi, 2 * np.pi) - np.pi
+    result = np.sqrt((eta1 - eta2) ** 2 + dphi ** 2)
+    invalid = (np.abs(eta1) > 9) | (np.abs(eta2) > 9) | (np.abs(phi1) > 6.3) | (np.abs(phi2) > 6.3)
+    return np.where(invalid, 99.0, result)
+
+FUNCTIONS = {
+    "abs": np.abs, "fabs": np.abs, "Abs": np.abs,
+    "sqrt": np.sqrt, "Sqrt": np.sqrt,
+    "exp": np.exp, "Exp": np.exp,
+    "log": np.log, "Log": np.log, "log10": np.log10, "Log10": np.log10,
+    "pow": np.power, "Power": np.power,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "Sin": np.sin, "Cos": np.cos, "Tan": np.tan,
+    "atan2": np.arctan2, "ATan2": np.arctan2, "cosh": np.cosh, "sinh": np.sinh, "CosH": np.cosh, "SinH": np.sinh,
+    "min": np.minimum, "max": np.maximum, "Min": np.minimum, "Max": np.maximum,
+    "Pi": lambda: np.pi,
+    "double": lambda x: np.asarray(x, dtype=np.float64),
+    "float": lambda x: np.asarray(x, dtype=np.float32),
+    "int": lambda x: np.trunc(x).astype(np.int64),
+    "bool": lambda x: np.asarray(x, dtype=bool),
+    "deltaR": _deltaR,
+    # logical operators, C++ && || ! are element-wise
+    "_and": lambda *values: functools.reduce(np.logical_and, values),
+    "_or": lambda *values: functools.reduce(np.logical_or, values),
+    "_not": np.logical_not,
+    "_div": lambda a, b: _divide(a, b),
+    "_mod": lambda a, b: _modulo(a, b),
+    "true": True, "false": False,
+}
+
+def _integer(value):
+    return np.issubdtype(np.asarray(value).dtype, np.integer)
+
+def _divide(a, b):
+    # integer / integer truncates in C++, NumPy would give the float quotient
+    if _integer(a) and _integer(b):
+        raise ValueError("Integer division has C++ semantics the uproot engine does not reproduce, make an operand floating point or use the ROOT engine")
+    return np.true_divide(a, b)
+
+def _modulo(a, b):
+    # C++ % only exists for integers and truncates towards zero like fmod, Python's % floors
+    if not (_integer(a) and _integer(b)):
+        raise ValueError("% of floating point values does not compile in C++, use fmod or the ROOT engine")
+    return np.fmod(a, b)
+
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Constant, ast.Load,
+                  ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.UAdd, ast.USub, ast.Invert,
+                  ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.BoolOp, ast.And, ast.Or)
+
+class _Vectorize(ast.NodeTransformer):
+    """Turn the boolean operators, C++ ! (parsed as ~, which binds like it) and / % into element-wise calls."""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = "_and" if isinstance(node.op, ast.And) else "_or"
+        return ast.copy_location(ast.Call(ast.Name(func, ast.Load()), node.values, []), node)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Invert):
+            return ast.copy_location(ast.Call(ast.Name("_not", ast.Load()), [node.operand], []), node)
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, (ast.Div, ast.Mod)):
+            func = "_div" if isinstance(node.op, ast.Div) else "_mod"
+            return ast.copy_location(ast.Call(ast.Name(func, ast.Load()), [node.left, node.right], []), node)
+        return node
+
+def _check_cpp(tree, expression):
+    """Reject the constructs that parse in Python but mean something else in C++."""
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Expression '{expression}' is not supported by the uproot engine ({type(node).__name__}), use the ROOT engine")
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            raise ValueError(f"Chained comparison in '{expression}' has no C++ equivalent")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div) and all(isinstance(side, ast.Constant) and type(side.value) is int for side in (node.left, node.right)):
+            raise ValueError(f"Integer division in '{expression}' truncates in C++, write it with a floating point constant")
+        # !x > y is (!x) > y in C++, which is rarely what was meant: require parentheses
+        operands = [node.left, node.right] if isinstance(node, ast.BinOp) else [node.left] + node.comparators if isinstance(node, ast.Compare) else []
+        if any(isinstance(operand, ast.UnaryOp) and isinstance(operand.op, ast.Invert) for operand in operands):
+            raise ValueError(f"'!' directly applied to an operand of a comparison or arithmetic in '{expression}', add parentheses")
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(expression):
+    """Compile a C++ Config expression into Python code on arrays, returns (code, referenced names).
+
+    Constructs whose C++ meaning NumPy does not reproduce (integer division, % on floats, bitwise operators,
+    ambiguous uses of !) raise ValueError instead of silently giving other results than the ROOT engine.
+    """
+    text = str(expression)
+    if re.search(r"[~^&|]|<<|>>|//|\*\*", text.replace("&&", "").replace("||", "")):
+        raise ValueError(f"Expression '{expression}' uses operators not supported by the uproot engine, use the ROOT engine")
+    text = re.sub(r"\b(?:std|TMath)::", "", text)
+    text = text.replace("&&", " and ").replace("||", " or ")
+    # C++ ! binds tighter than any binary operator, as Python's ~ does, unlike Python's not
+    text = re.sub(r"!(?!=)", "~", text)
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError:
+        raise ValueError(f"Expression '{expression}' is not supported by the uproot engine, use the ROOT engine") from None
+    _check_cpp(tree, expression)
+    tree = _Vectorize().visit(tree)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS):
+            raise ValueError(f"Function in '{expression}' is not supported by the uproot engine, use the ROOT engine")
+        if isinstance(node, ast.Name) and node.id not in FUNCTIONS:
+            names.add(node.id)
+    return compile(ast.fix_missing_locations(tree), str(expression), "eval"), frozenset(names)
+
+def evaluate(expression, columns, nentries):
+    code, _ = compile_expression(str(expression))
+    return np.broadcast_to(np.asarray(eval(code, {"__builtins__": {}}, dict(FUNCTIONS, **columns))), (nentries,))
+
+class Histogram:
+    """Contents and sum of squared weights of one 1D histogram, flow bins included like a TH1."""
+
+    def __init__(self, variable):
+        ## variable = [branch name, plot name, x-axis label, nbins, xlow, xhigh]
+        if isinstance(variable[3], list):  # Variable binning
+            self.edges = np.asarray(variable[3], dtype=np.float64)
+            self.nbins = len(variable[3]) - 1
+            self.uniform = False
+        else:  # Uniform binning
+            self.nbins = variable[3]
+            self.edges = np.linspace(variable[4], variable[5], variable[3] + 1)
+            self.uniform = True
+        self.xmin, self.xmax = float(self.edges[0]), float(self.edges[-1])
+        self.sumw = np.zeros(self.nbins + 2)
+        self.sumw2 = np.zeros(self.nbins + 2)
+        self.entries = 0
+        self.stats = np.zeros(4)  # sum w, w^2, w*x, w*x^2 of the entries inside the axis range, as TH1 keeps them
+
+    def find_bins(self, values):
+        """Same bin numbers as TAxis::FindFixBin, NaN goes to the overflow."""
+        if self.uniform:
+            with np.errstate(invalid="ignore"):
+                bins = 1 + np.nan_to_num(self.nbins * (values - self.xmin) / (self.xmax - self.xmin), nan=0).astype(np.int64)
+        else:
+            bins = np.searchsorted(self.edges, values, side="right")
+        return np.where(values < self.xmin, 0, np.where(values < self.xmax, bins, self.nbins + 1))
+
+    def fill(self, values, weights=None):
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=np.float64)
+        bins = self.find_bins(values)
+        self.sumw += np.bincount(bins, weights=weights, minlength=self.nbins + 2)
+        self.sumw2 += np.bincount(bins, weights=weights * weights, minlength=self.nbins + 2)
+        self.entries += len(values)
+        inside = (bins > 0) & (bins <= self.nbins)
+        w, x = weights[inside], values[inside]
+        self.stats += [w.sum(), (w * w).sum(), (w * x).sum(), (w * x * x).sum()]
+
+    def to_uproot(self, name):
+        import uproot
+        axis = uproot.writing.identify.to_TAxis("xaxis", "", self.nbins, self.xmin, self.xmax, None if self.uniform else self.edges)
+        return uproot.writing.identify.to_TH1x(name, "", self.sumw, self.entries, *self.stats, self.sumw2, axis)
+
+def selection(config_file, task):
+    """Cut stages, global cut and sample cut, combined with AND like the filters of booking.build_sample_graph."""
+    cuts = [expression for _, expression in config_file.cut_stages] + [str(config_file.cuts)]
+    if task["cuts"] is not None and str(task["cuts"]) != "1":
+        cuts.append(str(task["cuts"]))
+    return cuts
+
+def task_columns(config_file, task):
+    """Branches read for one fill task, every name referenced by its expressions."""
+    names = set()
+    for expression in fillspec.task_expressions(config_file, task):
+        names |= compile_expression(str(expression))[1]
+    return sorted(names)
+
+def fill_chunk(config_file, task, columns, dtypes, nentries, histos):
+    def passed(columns):
+        mask = np.ones(nentries, dtype=bool)
+        for cut in selection(config_file, task):
+            mask &= evaluate(cut, columns, nentries).astype(bool)
+        return mask
+
+    mask = passed(columns)
+    weights = evaluate(config_file.weights, columns, nentries).astype(np.float64) if task["weighted"] else None
+    values = {variable[1]: evaluate(variable[0], columns, nentries)[mask] for variable in task["variables"]}
+    for variable in task["variables"]:
+        histos[(variable[1], task["label"])].fill(values[variable[1]], None if weights is None else weights[mask])
+    if not task["weighted"]:
+        return
+    # weight variations multiply the nominal weight, the selection is unchanged
+    for name, tags in config_file.weight_variations.items():
+        for tag, factor in tags.items():
+            varied_weights = (weights * evaluate(factor, columns, nentries))[mask]
+            for variable in task["variables"]:
+                histos[(variable[1], fillspec.variation_label(task["label"], f"{name}_{tag}"))].fill(values[variable[1]], varied_weights)
+    # column variations replace the column in the cuts and the variables, the weight is defined before the Vary
+    for name, (column, tags) in config_file.column_variations.items():
+        for tag, expression in tags.items():
+            # static_cast to the branch type, as in booking.apply_variations
+            varied = evaluate(expression, columns, nentries).astype(dtypes[column]).astype(columns[column].dtype)
+            varied_columns = dict(columns, **{column: varied})
+            varied_mask = passed(varied_columns)
+            for variable in task["variables"]:
+                values = evaluate(variable[0], varied_columns, nentries)[varied_mask]
+                histos[(variable[1], fillspec.variation_label(task["label"], f"{name}_{tag}"))].fill(values, weights[varied_mask])
+
+def fill_task(config_file, task, step_size):
+    """Stream the inputs of one fill task in chunks of step_size and fill all its histograms, returns {(plot name, label): Histogram}."""
+    import uproot
+    labels = [task["label"]]
+    if task["weighted"]:
+        labels += [fillspec.variation_label(task["label"], suffix) for _, suffix in fillspec.variations(config_file)]
+    histos = {(variable[1], label): Histogram(variable) for variable in task["variables"] for label in labels}
+    columns = task_columns(config_file, task)
+    # the global entry range of the task, translated into a range inside every file
+    begin, end = task["range"] or (0, task["entries"])
+    total = inputs.selected_entries(task)
+    start_time = time.time()
+    nevents = 0
+    offset = 0
+    for path, file_entries in zip(task["files"], task["file_entries"]):
+        entry_start, entry_stop = max(begin - offset, 0), min(end - offset, file_entries)
+        offset += file_entries
+        if entry_start >= entry_stop:
+            continue
+        with uproot.open(path) as tfile:
+            for chunk in tfile["Events"].iterate(columns, step_size=step_size, entry_start=entry_start, entry_stop=entry_stop, library="np"):
+                for name, array in chunk.items():
+                    if array.dtype == object:
+                        raise ValueError(f"Branch {name} is not a scalar branch, use the ROOT engine")
+                # float branches are promoted like in the C++ expressions, where they mostly meet double constants
+                dtypes = {name: array.dtype for name, array in chunk.items()}
+                chunk = {name: array.astype(np.float64) if array.dtype == np.float32 else array for name, array in chunk.items()}
+                nentries = len(chunk[columns[0]])
+                fill_chunk(config_file, task, chunk, dtypes, nentries, histos)
+                nevents += nentries
+                print_progress(nevents, total, time.time() - start_time)
+    print_progress(nevents, total, time.time() - start_time, final=True)
+    profiling.set_input(task["label"], events=nevents)
+    return histos
+
+def print_progress(done, total, elapsed, final=False):
+    """Same progress line as the ROOT engine callbacks in rdf_callbacks.C."""
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate > 0 and total > done else 0
+    percent = 100 * done / total if total > 0 else 100
+    print(f"\r[PROGRESS] {done} / {total} entries ({percent:5.1f} %), {rate:.3g} entries/s, ETA {eta:.0f} s   ", end="\n" if final else "", file=sys.stderr, flush=True)
+
+def fill_tasks(config_file, tasks):
+    """Fill every task with the columnar engine, the overflow is folded as in the ROOT engine. Returns {(plot name, label): Histogram}."""
+    histos = {}
+    for task in tasks:
+        print(f"Reading sample {task['label']} with uproot")
+        with profiling.stage("columnar_fill", sample=task["label"]):
+            histos.update(fill_task(config_file, task, config_file.columnar_step_size))
+    for hist in histos.values():
+        histarrays.fold_arrays(hist.sumw, hist.sumw2)
+    return histos
+
+def write_histograms(filename, histos):
+    """Write {(plot name, sample): Histogram} with uproot, same <plot name>/<sample> layout as histstore.write_histograms."""
+    import uproot
+    with uproot.recreate(filename) as tfile:
+        for (plot_name, sample), hist in histos.items():
+            tfile[f"{plot_name}/{sample}"] = hist.to_uproot(sample)
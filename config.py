@@ -1,15 +1,6 @@
-import ROOT
+import copy
 import os
 
-ROOT.gStyle.SetLegendBorderSize(0)
-ROOT.gStyle.SetPadLeftMargin(0.15) 
-ROOT.gStyle.SetTitleYOffset(1.5) 
-ROOT.gStyle.SetOptStat(0)
-ROOT.gStyle.SetTextSize(0.035)  
-ROOT.gStyle.SetGridStyle(2)
-ROOT.gStyle.SetGridColor(ROOT.kGray+2)
-ROOT.gStyle.SetGridWidth(1)
-
 class Config:
   
   def __init__(self):  
@@ -72,23 +63,75 @@ class Config:
       # ["deltaR(lep3_eta, lep4_eta, lep3_phi, lep4_phi)","dR_lep3_lep_4","#DeltaR(lep3,lep4)", 60, 0, 6],
       ]
     
+    ## multi-dimensional histograms (Histo2D, Histo3D, HistoND above 3 axes), filled in the same event loop as vars
+    ## {"name": plot name, "axes": [[expression, axis label, nbins, xlow, xhigh] or [expression, axis label, [bin edges]], ...],
+    ##  "projections": [{"axis": projected axis, "slices": {other axis: [low, high]}, "name": plot name (optional)}, ...]}
+    ## they are stored without overflow folding, render draws the 1D projections and folds those
+    self.nd_vars = [
+      # {"name": "Hcandidate_mass_vs_cvbdisc_0", "axes": [[self.H_prefix + "mass", "H candidate mass [GeV]", 56, 70, 350], [self.jet_prefix + "cvbdisc[0]", "leading jet c vs b score", [0, 0.2, 0.5, 1]]],
+      #  "projections": [{"axis": 0}, {"axis": 0, "slices": {1: [0.5, 1]}}, {"axis": 1}]},
+      ]
+
     self.output_plots_dir = "plots/trees_17_04/2023"
     self.base_dir = "/eos/user/n/nplastir/H+c/trees_17_04/mc/2023/merged"
+    ## [stage name, expression], applied in order before cuts and listed in the cut-flow report
+    self.cut_stages = [
+      # ["4 leptons", "nlep >= 4"],
+      ]
     self.cuts = "1" # if you don't want cuts remember to put "1"
     self.weights =  "genWeight * xsecWeight * lumiwgt * puWeight * muEffWeight * elEffWeight" #"LHEScaleWeightNorm * LHEPdfWeightNorm * PSWeightNorm"
+    ## systematic variations, filled in the same event loop as the nominal histograms and drawn as an envelope band
+    ## weight variations: {name: {tag: factor multiplied onto the nominal weights}}
+    self.weight_variations = {
+      # "scale": {"up": "LHEScaleWeightNorm", "down": "1. / LHEScaleWeightNorm"},
+      # "pdf": {"up": "LHEPdfWeightNorm", "down": "1. / LHEPdfWeightNorm"},
+      # "ps": {"up": "PSWeightNorm", "down": "1. / PSWeightNorm"},
+      }
+    ## shifted columns: {name: [column, {tag: expression replacing the column}]}
+    self.column_variations = {
+      # "H_mass_scale": ["H_mass", {"up": "H_mass * 1.01", "down": "H_mass * 0.99"}],
+      }
     self.plot_format = "png"
+    self.cache_dir = "cache" # histograms filled in previous runs, use --no-cache/--rebuild to bypass
+    self.cache_max_size_mb = 2000
+    self.skim_dir = "skims" # written by "skim", read instead of base_dir files while they are valid
+    self.histogram_store = os.path.join(self.output_plots_dir, "histograms.root") # written by "fill", read by "render"
+    self.data_files = ["EGamma_merged.root", "MuonEG_merged.root", "Muon_merged.root"] # file names or glob patterns inside the -d directory
+    self.dataset_manifest = None # JSON {"samples": {sample: [files or patterns]}, "data": [files or patterns]}, overrides base_dir and -d
+    self.fill_backend = "local" # "local", "dask" (distributed RDataFrame) or "multiprocessing"
+    self.dist_nworkers = 4 # worker processes of the local Dask cluster or process pool
+    self.dist_npartitions = 16 # partitions per input for the dask and multiprocessing backends
+    self.dask_scheduler = None # address of an existing Dask scheduler, None starts a LocalCluster
+    self.fill_engine = "root" # "root" (RDataFrame) or "uproot" (NumPy, scalar branches and simple expressions only)
+    self.columnar_step_size = "100 MB" # chunk size read at once by the uproot engine, bounds its memory
+    self.memory_budget_mb = None # fill the samples in batches whose estimated event loop memory fits this budget, None fills all at once
+    ## batch mode (--eras): all eras are filled in one process and one RunGraphs call, each into its own store
+    ## {"name": era, "base_dir": MC directory, "lumi": luminosity legend, "data_dir": data directory or None}
+    self.eras = [
+      # {"name": "2022", "base_dir": "/eos/user/n/nplastir/H+c/trees_17_04/mc/2022/merged", "lumi": "7.98", "data_dir": None},
+      # {"name": "2022EE", "base_dir": "/eos/user/n/nplastir/H+c/trees_17_04/mc/2022EE/merged", "lumi": "26.67", "data_dir": None},
+      # {"name": "2023", "base_dir": "/eos/user/n/nplastir/H+c/trees_17_04/mc/2023/merged", "lumi": "17.794", "data_dir": None},
+      # {"name": "2023BPix", "base_dir": "/eos/user/n/nplastir/H+c/trees_17_04/mc/2023BPix/merged", "lumi": "9.451", "data_dir": None},
+      ]
+    ## combined eras, summed from the stores of their eras without another event loop
+    self.era_combinations = {
+      # "2022_Combined": ["2022", "2022EE"],
+      # "2023_Combined": ["2023", "2023BPix"],
+      # "2022_2023": ["2022", "2022EE", "2023", "2023BPix"],
+      }
     self.set_year_dependent_values()
 
     self.stack_ymin = 1
     self.stack_ymax = 5e6
     self.set_logy = False 
+    self.render_binning = {} # {plot name: [bin edges]} drawn instead of the filled binning, the edges must be a subset of the filled ones
     self.samples_dict = {}
         
   ## YOU DON'T NEED TO CHANGE ANYTHING HERE
   ## useful functions
   
   def add_sample(self,name,root_file,cuts):
-    self.samples_dict[name] = [root_file,cuts]
+    self.samples_dict[name] = [root_file,str(cuts)]
 
   def get_samples_filenames(self):
     filenames = []
@@ -96,6 +139,31 @@ class Config:
         filenames.append(self.samples_dict[sample][0])
     return filenames
   
+  def get_data_filenames(self):
+    filenames = list(self.data_files)
+    if "2022" in os.path.normpath(self.base_dir).split(os.sep):
+      filenames += ["DoubleMuon_merged.root", "SingleMuon_merged.root"]
+    return filenames
+  
+  def era_config(self, era):
+    """Copy of this configuration for one era of the batch mode, its outputs go next to output_plots_dir."""
+    era_config = copy.copy(self)
+    era_config.base_dir = era["base_dir"]
+    era_config.output_plots_dir = os.path.join(os.path.dirname(os.path.normpath(self.output_plots_dir)), era["name"])
+    era_config.histogram_store = os.path.join(era_config.output_plots_dir, "histograms.root")
+    era_config.skim_dir = os.path.join(self.skim_dir, era["name"])
+    era_config.set_year_dependent_values()
+    era_config.dataset_legend = str(era["lumi"])
+    return era_config
+
+  def combined_config(self, name, era_configs):
+    """Copy of this configuration for a combination of eras, the luminosity is the sum of theirs."""
+    combined = copy.copy(era_configs[0])
+    combined.output_plots_dir = os.path.join(os.path.dirname(os.path.normpath(self.output_plots_dir)), name)
+    combined.histogram_store = os.path.join(combined.output_plots_dir, "histograms.root")
+    combined.dataset_legend = f"{sum(float(era.dataset_legend) for era in era_configs):.4g}"
+    return combined
+
   def set_year_dependent_values(self):
     # Define mapping of years to (energy, dataset_legend)
     year_settings = {
@@ -0,0 +1,43 @@
+import ROOT
+import fcntl
+import hashlib
+import os
+
+## The C++ helpers are compiled once with ACLiC into a shared library that is cached per source hash,
+## later runs only gSystem.Load it instead of letting Cling parse and JIT the source again.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CPP_HELPERS = os.path.join(HERE, "cpp_functions.C")
+BUILD_DIR = os.path.join(HERE, "build")
+
+def source_hash(source):
+    digest = hashlib.sha1()
+    with open(source, "rb") as f:
+        digest.update(f.read())
+    # a library built against another ROOT version cannot be loaded
+    digest.update(ROOT.gROOT.GetVersion().encode())
+    return digest.hexdigest()[:16]
+
+def load(source=CPP_HELPERS, build_dir=BUILD_DIR):
+    """Load the compiled helpers, building them first if the source changed. Returns the library path."""
+    name = os.path.splitext(os.path.basename(source))[0] + "_C"
+    out_dir = os.path.join(build_dir, source_hash(source))
+    library = os.path.join(out_dir, name + "." + ROOT.gSystem.GetSoExt())
+    os.makedirs(out_dir, exist_ok=True)
+
+    # many small jobs may start at the same time, only one of them compiles
+    with open(os.path.join(out_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(library):
+            if ROOT.gSystem.Load(library) < 0:
+                raise RuntimeError(f"Cannot load {library}")
+        else:
+            print(f"[INFO] Compiling {source} into {out_dir}")
+            # k: keep the library, O: optimised build, CompileMacro also loads it
+            # the library path is absolute, so no build_dir: ACLiC would otherwise nest the full path inside it
+            if not ROOT.gSystem.CompileMacro(source, "kO", library):
+                raise RuntimeError(f"Cannot compile {source}")
+            if not os.path.exists(library):
+                raise RuntimeError(f"Compiling {source} did not produce {library}")
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return library
@@ -0,0 +1,37 @@
+## What the fill stage books and how it is named in the store, shared by the ROOT engine and the uproot engine,
+## so nothing here may import ROOT.
+
+## Histograms are stored as <plot name>/<sample>, real data is stored under the sample name "data"
+DATA_NAME = "data"
+## systematic variations of a sample are stored next to it as <sample>__<variation>_<tag>
+VARIATION_SEP = "__"
+## one-bin histogram per sample holding its selected sum of weights (content), sum of squared weights and entries
+YIELDS_NAME = "sample_yields"
+
+def variation_label(sample, suffix):
+    return f"{sample}{VARIATION_SEP}{suffix}"
+
+## Filled like a config.vars entry: a constant inside the single bin gives the per-sample yield, its sumw2 and
+## the effective number of entries (sumw^2 / sumw2) from the same event loop as the plots
+YIELDS_VARIABLE = ["0.5", YIELDS_NAME, "Yield", 1, 0, 1]
+
+def variations(config_file):
+    """All systematic variations as [(RDataFrame variation key, store suffix)], e.g. ("scale:up", "scale_up")."""
+    result = []
+    for name, tags in list(config_file.weight_variations.items()) + [(name, spec[1]) for name, spec in config_file.column_variations.items()]:
+        for tag in tags:
+            result.append((f"{name}:{tag}", f"{name}_{tag}"))
+    return result
+
+def task_expressions(config_file, task):
+    """Every expression the computation graph of a fill task evaluates."""
+    expressions = [config_file.cuts, task["cuts"]] + [expression for _, expression in config_file.cut_stages]
+    expressions += [variable[0] for variable in task["variables"]]
+    expressions += [axis[0] for spec in task["nd_variables"] for axis in spec["axes"]]
+    if task["weighted"]:
+        expressions.append(config_file.weights)
+        for tags in config_file.weight_variations.values():
+            expressions += list(tags.values())
+        for column, tags in config_file.column_variations.values():
+            expressions += [column] + list(tags.values())
+    return [expression for expression in expressions if expression is not None]
@@ -0,0 +1,24 @@
+import numpy as np
+
+## Functions on plain arrays in the TH1 bin layout (index 0 underflow, index nbins + 1 overflow), used on the
+## views of histops.py and on the arrays of the uproot engine, which must not import ROOT.
+
+def fold_arrays(sumw, sumw2, underflow=False, overflow=True):
+    """Add the flow bins into the first/last bin in place, the last axis holds the bins so batches can be stacked."""
+    if underflow:
+        sumw[..., 1] += sumw[..., 0]
+        sumw2[..., 1] += sumw2[..., 0]
+        sumw[..., 0] = 0
+        sumw2[..., 0] = 0
+    if overflow:
+        sumw[..., -2] += sumw[..., -1]
+        sumw2[..., -2] += sumw2[..., -1]
+        sumw[..., -1] = 0
+        sumw2[..., -1] = 0
+
+def ratio_arrays(num, num_sumw2, den, den_sumw2):
+    """Ratio and its sum of squared weights with uncorrelated errors like TH1::Divide, bins with den == 0 are 0."""
+    safe = np.where(den != 0, den, 1)
+    value = np.where(den != 0, num / safe, 0)
+    variance = np.where(den != 0, (num_sumw2 * den * den + den_sumw2 * num * num) / safe ** 4, 0)
+    return value, variance
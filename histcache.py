@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+class HistogramCache:
+    """On-disk cache of filled histograms, one ROOT file per set of input files.
+
+    ROOT is only imported to read and write entries, the key and identity helpers also serve the uproot engine.
+    """
+
+    def __init__(self, cache_dir, max_size_mb, rebuild=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        self.rebuild = rebuild  # ignore existing entries, but still write new ones
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _hash(obj):
+        return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def input_identity(input_paths):
+        ## path, size and mtime of every input file, any change invalidates the entries
+        identity = []
+        for path in input_paths:
+            st = os.stat(path)
+            identity.append([os.path.abspath(path), st.st_size, int(st.st_mtime)])
+        return identity
+
+    def cache_file(self, input_paths):
+        return os.path.join(self.cache_dir, self._hash(self.input_identity(input_paths))[:20] + ".root")
+
+    @staticmethod
+    def histogram_key(cuts, weights, expression, binning):
+        return "h_" + HistogramCache._hash([str(cuts), str(weights), expression, binning])
+
+    def load(self, input_paths, key):
+        import ROOT
+        import histstore
+        if self.rebuild:
+            self.misses += 1
+            return None
+        filename = self.cache_file(input_paths)
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        tfile = ROOT.TFile.Open(filename, "READ")
+        hist = tfile.Get(key) if tfile and not tfile.IsZombie() else None
+        if not hist:
+            if tfile:
+                tfile.Close()
+            self.misses += 1
+            return None
+        histstore.detach(hist)
+        tfile.Close()
+        os.utime(filename)  # mark as recently used for the eviction
+        self.hits += 1
+        return hist
+
+    def store(self, input_paths, histos):
+        ## histos = {key: TH1}
+        if not histos:
+            return
+        import ROOT
+        filename = self.cache_file(input_paths)
+        tfile = ROOT.TFile.Open(filename, "UPDATE")
+        for key, hist in histos.items():
+            tfile.WriteObject(hist, key, "Overwrite")
+        tfile.Close()
+
+    def evict(self):
+        """Remove the least recently used cache files until the cache fits in max_size."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".root") and os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            print(f"[INFO] Evicting cache file {path}")
+            os.remove(path)
+            total -= size
+
+    def summary(self):
+        print(f"[INFO] Histogram cache: {self.hits} hit(s), {self.misses} miss(es)")
@@ -0,0 +1,136 @@
+import ROOT
+import numpy as np
+import histarrays
+
+## Post-processing on NumPy views of the TH1 contents and sum of squared weights, flow bins included
+## (index 0 underflow, index nbins + 1 overflow). Every function takes a whole batch of histograms and
+## replaces the per-bin PyROOT calls, the functions on plain arrays are in histarrays.py.
+
+_DTYPES = {"TH1D": np.float64, "TH1F": np.float32}
+
+def _view(buffer, dtype, ncells):
+    buffer.reshape((ncells,))  # the low-level view of a raw C++ pointer has no size of its own
+    return np.frombuffer(buffer, dtype=dtype, count=ncells)
+
+def contents(hist):
+    """Writable view of the bin contents of a TH1D or TH1F, length nbins + 2."""
+    return _view(hist.GetArray(), _DTYPES[hist.ClassName()], hist.GetNcells())
+
+def sumw2(hist):
+    """Writable view of the sum of squared weights, created from the contents if the histogram has none yet."""
+    if hist.GetSumw2N() == 0:
+        hist.Sumw2()
+    return _view(hist.GetSumw2().GetArray(), np.float64, hist.GetNcells())
+
+def bin_edges(hist):
+    """Edges of the x axis, read from the edge array of variable bins or computed for uniform bins."""
+    axis = hist.GetXaxis()
+    nbins = axis.GetNbins()
+    xbins = axis.GetXbins()
+    if xbins.GetSize() == nbins + 1:
+        return _view(xbins.GetArray(), np.float64, nbins + 1).copy()
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+def fold_flow(histos, underflow=False, overflow=True):
+    """Same as utils.add_underflow/add_overflow on every histogram, in place."""
+    for hist in histos:
+        histarrays.fold_arrays(contents(hist), sumw2(hist), underflow, overflow)
+        hist.ResetStats()
+    return histos
+
+def normalize(histos):
+    """Scale every histogram with a non-zero integral to unit area (the shape plots), errors are scaled accordingly."""
+    for hist in histos:
+        values, variances = contents(hist), sumw2(hist)
+        integral = values[1:-1].sum()
+        if integral != 0:
+            values /= integral
+            variances /= integral * integral
+            hist.ResetStats()
+    return histos
+
+def rebin(histos, edges):
+    """New histograms with the given variable bin edges, which must be a subset of the original edges."""
+    edges = np.asarray(edges, dtype=np.float64)
+    rebinned = []
+    for hist in histos:
+        old_edges = bin_edges(hist)
+        index = np.searchsorted(old_edges, edges)
+        if np.any(index >= len(old_edges)) or not np.allclose(old_edges[index], edges):
+            raise ValueError(f"Edges {list(edges)} are not a subset of the binning of {hist.GetName()}")
+        new = ROOT.TH1D(f"{hist.GetName()}_rebinned", hist.GetTitle(), len(edges) - 1, edges)
+        new.SetDirectory(0)
+        new.Sumw2()
+        # bins below the first and above the last new edge end up in the new flow bins
+        starts = np.concatenate(([0], index + 1))
+        contents(new)[:] = np.add.reduceat(contents(hist).astype(np.float64), starts)
+        sumw2(new)[:] = np.add.reduceat(sumw2(hist), starts)
+        new.SetEntries(hist.GetEntries())
+        new.ResetStats()
+        rebinned.append(new)
+    return rebinned
+
+def stack_total(histos, name):
+    """Sum of histograms with the same binning, e.g. the total of an MC stack."""
+    histos = list(histos)
+    total = histos[0].Clone(name)
+    total.SetDirectory(0)
+    contents(total)[:] = np.sum([contents(hist) for hist in histos], axis=0)
+    sumw2(total)[:] = np.sum([sumw2(hist) for hist in histos], axis=0)
+    total.SetEntries(sum(hist.GetEntries() for hist in histos))
+    total.ResetStats()
+    return total
+
+def ratio(numerator, denominator, name, denominator_errors=True):
+    """numerator / denominator as a new histogram, without denominator_errors only the numerator errors propagate."""
+    result = numerator.Clone(name)
+    result.SetDirectory(0)
+    den_sumw2 = sumw2(denominator) if denominator_errors else np.zeros(denominator.GetNcells())
+    value, variance = histarrays.ratio_arrays(contents(numerator).astype(np.float64), sumw2(numerator), contents(denominator).astype(np.float64), den_sumw2)
+    contents(result)[:] = value
+    sumw2(result)[:] = variance
+    result.ResetStats()
+    return result
+
+def poisson_errors(counts, alpha=1 - 0.682689492137086):
+    """Lower and upper Garwood errors of observed counts, the same as TH1::GetBinErrorLow/Up with TH1::kPoisson."""
+    counts = np.asarray(counts, dtype=np.float64)
+    n = counts.astype(np.int64)
+    low = np.array([c - ROOT.Math.gamma_quantile(alpha / 2, k, 1.) if k > 0 else 0. for c, k in zip(counts, n)])
+    up = np.array([ROOT.Math.gamma_quantile_c(alpha / 2, k + 1, 1.) - c for c, k in zip(counts, n)])
+    return low, up
+
+def project(hist, axis, slices, name):
+    """1D projection of a TH2, TH3 or THn on one axis, the other axes restricted to slices {axis index: [low, high]}.
+
+    Axes without a slice are summed including their flow bins, the high edge of a slice is exclusive.
+    """
+    is_thn = hist.InheritsFrom("THnBase")
+    if is_thn:
+        axes = [hist.GetAxis(i) for i in range(hist.GetNdimensions())]
+    else:
+        axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+    ranges = []
+    for i, other in enumerate(axes):
+        if i == axis:
+            continue
+        first, last = 0, other.GetNbins() + 1
+        if i in slices:
+            low, high = slices[i]
+            first, last = other.FindFixBin(low), other.FindFixBin(high)
+            if other.GetBinLowEdge(last) == high:
+                last -= 1
+        ranges.append((i, first, last))
+    if is_thn:
+        for i, first, last in ranges:
+            axes[i].SetRange(first, last)
+        result = hist.Projection(axis, "E")
+        result.SetName(name)
+        for other in axes:
+            other.SetRange()
+    else:
+        # TH2::ProjectionX(name, ybin1, ybin2), TH3::ProjectionX(name, ybin1, ybin2, zbin1, zbin2), same for the other axes
+        bins = [limit for _, first, last in ranges for limit in (first, last)]
+        result = getattr(hist, "Projection" + "XYZ"[axis])(name, *bins, "e")
+    result.SetDirectory(0)
+    return result
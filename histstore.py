@@ -0,0 +1,86 @@
+import ROOT
+import os
+
+## Histograms are stored as <plot name>/<label>, see fillspec for the labels
+
+def detach(hist):
+    """Keep a histogram alive after its file is closed, THn objects are never attached to a directory."""
+    if hist.InheritsFrom("TH1"):
+        hist.SetDirectory(0)
+    return hist
+
+def write_histograms(filename, histos, mode="RECREATE"):
+    """Write {(plot name, sample): TH1} to a single ROOT file."""
+    tfile = ROOT.TFile.Open(filename, mode)
+    for (plot_name, sample), hist in histos.items():
+        directory = tfile.GetDirectory(plot_name) or tfile.mkdir(plot_name)
+        directory.WriteObject(hist, sample, "Overwrite")
+    tfile.Close()
+
+def stored_keys(filename):
+    """Set of (plot name, sample) of every histogram in the store without reading them, empty if there is no store."""
+    keys = set()
+    if not os.path.exists(filename):
+        return keys
+    tfile = ROOT.TFile.Open(filename, "READ")
+    if not tfile or tfile.IsZombie():
+        return keys
+    for plot_key in tfile.GetListOfKeys():
+        directory = tfile.GetDirectory(plot_key.GetName())
+        if directory:
+            keys.update((plot_key.GetName(), key.GetName()) for key in directory.GetListOfKeys())
+    tfile.Close()
+    return keys
+
+def copy_histograms(source, target, keys):
+    """Copy the requested keys from one store into another one histogram at a time, returns the copied keys."""
+    copied = []
+    source_file = ROOT.TFile.Open(source, "READ")
+    if not source_file or source_file.IsZombie():
+        return copied
+    target_file = ROOT.TFile.Open(target, "UPDATE")
+    for plot_name, sample in keys:
+        hist = source_file.Get(f"{plot_name}/{sample}")
+        if not hist:
+            continue
+        directory = target_file.GetDirectory(plot_name) or target_file.mkdir(plot_name)
+        directory.WriteObject(hist, sample, "Overwrite")
+        # owned by Python from now on, so it is deleted right away instead of when the file closes
+        detach(hist)
+        ROOT.SetOwnership(hist, True)
+        copied.append((plot_name, sample))
+    target_file.Close()
+    source_file.Close()
+    return copied
+
+def read_variable(filename, plot_name):
+    """Return {sample: TH1} for one plot, the histograms are detached from the file."""
+    tfile = ROOT.TFile.Open(filename, "READ")
+    if not tfile or tfile.IsZombie():
+        raise OSError(f"Cannot open histogram store {filename}")
+    histos = {}
+    directory = tfile.GetDirectory(plot_name)
+    if directory:
+        for key in directory.GetListOfKeys():
+            hist = key.ReadObj()
+            detach(hist)
+            histos[key.GetName()] = hist
+    tfile.Close()
+    return histos
+
+def read_all(filename):
+    """Return every histogram of the store as detached {(plot name, sample): TH1}."""
+    tfile = ROOT.TFile.Open(filename, "READ")
+    if not tfile or tfile.IsZombie():
+        raise OSError(f"Cannot open histogram store {filename}")
+    histos = {}
+    for plot_key in tfile.GetListOfKeys():
+        directory = tfile.GetDirectory(plot_key.GetName())
+        if not directory:
+            continue
+        for key in directory.GetListOfKeys():
+            hist = key.ReadObj()
+            detach(hist)
+            histos[(plot_key.GetName(), key.GetName())] = hist
+    tfile.Close()
+    return histos
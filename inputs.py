@@ -0,0 +1,87 @@
+import functools
+import glob
+import json
+import os
+
+## Input discovery: the root_file of a sample and the entries of config.data_files may be glob patterns,
+## config.dataset_manifest may instead list the files as {"samples": {sample: [path or pattern, ...]}, "data": [...]}.
+## Entry counts are cached per file (path, size, mtime), ranges and progress reports then need no extra pass.
+## ROOT and uproot are only imported by the entry counters, the uproot engine runs without ROOT.
+
+def expand(patterns, base_dir=""):
+    """Sorted files matching each pattern, a pattern without any match is kept so that opening it reports the path."""
+    paths = []
+    for pattern in patterns:
+        pattern = os.path.join(base_dir, pattern)
+        matches = sorted(glob.glob(pattern))
+        paths += matches if matches else [pattern]
+    return paths
+
+@functools.lru_cache(maxsize=None)
+def load_dataset_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+def dataset_manifest(config_file):
+    return load_dataset_manifest(config_file.dataset_manifest) if config_file.dataset_manifest else {}
+
+def sample_inputs(config_file, sample, root_file):
+    listed = dataset_manifest(config_file).get("samples", {}).get(sample)
+    if listed:
+        return expand(listed)
+    return expand([root_file], config_file.base_dir)
+
+def data_inputs(config_file, data_dir=None):
+    """Data files from the -d directory, else from the dataset manifest, empty if neither is given."""
+    if data_dir:
+        return expand(config_file.get_data_filenames(), data_dir)
+    return expand(dataset_manifest(config_file).get("data", []))
+
+def selected_entries(task):
+    """Entries of a fill task inside its entry range."""
+    if task["range"] is None:
+        return task["entries"]
+    begin, end = task["range"]
+    return max(0, min(end, task["entries"]) - begin)
+
+def root_entries(file_path):
+    import ROOT
+    tfile = ROOT.TFile.Open(file_path, "READ")
+    entries = tfile.Get("Events").GetEntries()
+    tfile.Close()
+    return entries
+
+def uproot_entries(file_path):
+    import uproot
+    with uproot.open(file_path) as tfile:
+        return tfile["Events"].num_entries
+
+class EntryCounts:
+    """Per-file number of entries of the Events tree, cached in a JSON file, missing ones are read with count(file_path)."""
+
+    def __init__(self, path, count=root_entries):
+        self.path = path
+        self.count = count
+        self.counts = {}
+        self.changed = False
+        if os.path.exists(path):
+            with open(path) as f:
+                self.counts = json.load(f)
+
+    def get(self, file_path):
+        st = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry = self.counts.get(key)
+        if entry and entry["size"] == st.st_size and entry["mtime"] == int(st.st_mtime):
+            return entry["entries"]
+        entries = self.count(file_path)
+        self.counts[key] = {"size": st.st_size, "mtime": int(st.st_mtime), "entries": entries}
+        self.changed = True
+        return entries
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.counts, f, indent=2, sort_keys=True)
@@ -5,8 +5,10 @@ import os
 import config
 import time
 import utils
+import booking
+import cpplib
 ROOT.gROOT.SetBatch(True)
-ROOT.gInterpreter.ProcessLine('#include "cpp_functions.C"')
+cpplib.load() # compiled C++ helpers, rebuilt only when cpp_functions.C changes
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-t', '--type', type=str, help='Type of plots', choices=['stack', 'shape'], default='stack')
@@ -28,6 +30,26 @@ def create_plots(config_file):
     samples_filenames = config_file.get_samples_filenames()
     RDF_dict = {filename: create_RDF(filename) for filename in samples_filenames} 
 
+    # Build each computation graph once: shared filtered node and one Define per distinct expression
+    sample_nodes = {}
+    cutflow_reports = {}
+    for sample in samples_dict.keys():
+        node = booking.build_sample_graph(RDF_dict[samples_dict[sample][0]], config_file, samples_dict[sample][1])
+        cutflow_reports[sample] = node.Report()
+        sample_nodes[sample] = booking.define_variables(node, [variable[0] for variable in variables])
+
+    # Booking phase: register every histogram lazily, no event loop is started here
+    booked_histos = {}  # (variable, sample) -> RResultPtr
+    for variable in variables:
+        for sample in samples_dict.keys():
+            node, columns = sample_nodes[sample]
+            booked_histos[(variable[0], sample)] = node.Histo1D(utils.histo1d_model(f"hist_{sample}_{variable[0]}", variable), columns[variable[0]])
+
+    # Run all event loops together, each input is read once
+    ROOT.RDF.RunGraphs(list(booked_histos.values()) + list(cutflow_reports.values()))
+    utils.report_event_loops(RDF_dict)
+    booking.write_cutflow(cutflow_reports, os.path.join(config_file.output_plots_dir, "cutflow.txt"))
+
     for variable in variables:
         print(f"Plotting var {variable[0]}")
         
@@ -42,8 +64,7 @@ def create_plots(config_file):
         legend.SetFillStyle(0)
         
         for sample in samples_dict.keys():
-            df = RDF_dict[samples_dict[sample][0]]
-            hist = df.Filter(config_file.cuts).Define("plotvar_", variable[0]).Histo1D((f"hist_{sample}_{variable[0]}", "", variable[3], variable[4], variable[5]), "plotvar_")
+            hist = booked_histos[(variable[0], sample)]
             hist = utils.add_underflow(hist)
             hist = utils.add_overflow(hist)
             if args.type == "stack": 
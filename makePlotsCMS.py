@@ -1,220 +1,51 @@
-import ROOT
 import argparse
+import gc
 import os
 import config
 import time
-import utils
-import cmsstyle as CMS  # Import cmsstyle
-
-ROOT.ROOT.EnableImplicitMT()  # Enable multi-threading for RDataFrame
-ROOT.gInterpreter.ProcessLine('#include "cpp_functions.C"')
-ROOT.gROOT.SetBatch(True)
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--type', type=str, help='Type of plots', choices=['stack', 'shape'], default='stack')
-parser.add_argument('-d', '--data', type=str, help='Real data filename (optional)', default=None)
-args = parser.parse_args()
-
-def create_RDF(filename):
-    print(f"Creating RDF for sample {filename}")
-    filename_path = os.path.join(config_file.base_dir, filename)
-    df = ROOT.RDataFrame("Events", filename_path)
-
-    # Apply MC weights
-    df = df.Define("final_weight", config_file.weights)
-    return df
-
-def merge_data_RDF():
-    """Create a single RDataFrame from multiple ROOT data files."""
-    file_paths = [os.path.join(args.data, f) for f in DATA_FILES]
-    return ROOT.RDataFrame("Events", file_paths)
-
-def create_plots(config_file):
-    samples_dict = config_file.samples_dict
-    variables = config_file.vars
-
-    samples_filenames = config_file.get_samples_filenames()
-    RDF_dict = {filename: create_RDF(filename) for filename in samples_filenames}
-
-    # Load real data if provided
-    data_histos = None  # Default: no data
-    if args.data:
-        print("Loading and merging real data...")
-        data_df = merge_data_RDF()
-        data_histos = {}
-
-    # CMS Styling Settings
-    CMS.SetExtraText("Preliminary")
-    CMS.SetLumi(config_file.dataset_legend)
-    CMS.SetEnergy(config_file.energy)
-    CMS.ResetAdditionalInfo()
-
-    # Loop for each variable
-    for variable in variables:
-        print(f"Plotting var {variable[0]}")
-        histos_dict = {}
-
-        for sample in samples_dict.keys():
-            df = RDF_dict[samples_dict[sample][0]]
-            if isinstance(variable[3], list):  # Variable binning
-                bins_array = ROOT.std.vector("double")(variable[3])
-                hist = df.Filter(config_file.cuts).Define("plotvar_", variable[0]).Histo1D(
-                    (f"hist_{sample}_{variable[0]}", "", len(variable[3]) - 1, bins_array.data()), 
-                    "plotvar_", "final_weight"
-                )
-            else:  # Uniform binning
-                hist = df.Filter(config_file.cuts).Define("plotvar_", variable[0]).Histo1D(
-                (f"hist_{sample}_{variable[0]}", "", variable[3], variable[4], variable[5]), "plotvar_", "final_weight"
-            )
-            # hist = utils.add_underflow(hist)
-            hist = utils.add_overflow(hist)
-            # hist.SetLineColor(ROOT.kBlack)
-            # if args.type == "stack":
-            #     
-            # if args.type == "shape":
-            #     # hist.SetLineColor(config_file.colors[sample])
-            #     hist.Scale(1 / hist.Integral())
-            histos_dict[sample] = hist.GetPtr()
-
-        # Process real data histogram
-        if args.data:
-            if isinstance(variable[3], list):  # Variable binning
-                bins_array = ROOT.std.vector("double")(variable[3])
-                data_hist = data_df.Filter(config_file.cuts).Define("plotvar_", variable[0]).Histo1D(
-                    (f"hist_data_{variable[0]}", "", len(variable[3]) - 1, bins_array.data()), 
-                    "plotvar_"
-                )
-            else:  # Uniform binning
-                data_hist = data_df.Filter(config_file.cuts).Define("plotvar_", variable[0]).Histo1D(
-                    (f"hist_data_{variable[0]}", "", variable[3], variable[4], variable[5]), 
-                    "plotvar_"
-                )
-            # data_hist = utils.add_underflow(data_hist)
-            data_hist = utils.add_overflow(data_hist)
-            data_hist.SetMarkerStyle(20)
-            data_hist.SetMarkerColor(ROOT.kBlack)
-            data_histos[variable[0]] = data_hist.GetPtr()
-
-        # CMSStyle Canvas
-        canv_name = f"{variable[1]}_canvas"
-        y_title = "Events"
-        if isinstance(variable[3], list):  # Variable binning
-            x_min, x_max = variable[3][0], variable[3][-1]  # Use first and last bin edge
-        else:  # Uniform binning
-            x_min, x_max = variable[4], variable[5]  # Use configured range
-        canvas = CMS.cmsCanvas(canv_name, x_min, x_max, 0, 1, variable[2], y_title, square=CMS.kSquare, extraSpace=0.05, iPos=0)
-
-        # Define different stack plots for each case 
-        stack = ROOT.THStack("stack", f";{variable[2]};{y_title}")
-        stack_temp = ROOT.THStack("stack_temp", f";{variable[2]};{y_title}")
-        stack_ratio = ROOT.THStack("stack_ratio", f";{variable[2]};{y_title}")
-
-        legend = CMS.cmsLeg(0.22, 0.65, 0.92, 0.88, textSize=0.025, columns=4)
-
-        for sample, hist in histos_dict.items():
-            stack_temp.Add(hist)
-        
-        # Adjust y-axis offsets and log scaling
-        y_max = 1
-        y_min = 0.0
-        if config_file.set_logy:
-            canvas.SetLogy()
-            y_max = 10 * CMS.cmsReturnMaxY(stack_temp)
-            y_min = 0.1
-        # elif config_file.set_logy: 
-        #     y_max = 2.5 * CMS.cmsReturnMaxY(stack_temp)
-        else:
-            y_max = 1.2* CMS.cmsReturnMaxY(stack_temp)
-
-        # Set the CMS canvas y-axis
-        CMS.GetcmsCanvasHist(canvas).GetYaxis().SetRangeUser(y_min, y_max)
-        CMS.GetcmsCanvasHist(canvas).GetYaxis().SetTitleOffset(1.6)
-
-        scientific_notation = False
-        # Scientific notation
-        if scientific_notation:
-            hdf = CMS.GetcmsCanvasHist(canvas)
-            hdf.GetYaxis().SetMaxDigits(2)
-            # Shift multiplier position
-            ROOT.TGaxis.SetExponentOffset(-0.10, 0.01, "Y")
-
-        # Draw stack plot with cmsstyle
-        CMS.cmsDrawStack(stack, legend, histos_dict, data=(data_histos[variable[0]] if args.data else None))
-
-        # Save canvas
-        CMS.SaveCanvas(canvas,os.path.join(config_file.output_plots_dir, args.type, f"{variable[1]}." + config_file.plot_format), close= True)
-
-        #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-        # Ratio plots
-        #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-        
-        # CMSStyle DiCanvas
-        canv_name_ratio = f"{variable[1]}_canvas_ratio"
-        canvas_ratio = CMS.cmsDiCanvas(canv_name_ratio, x_min, x_max, y_min, y_max, 0, 2, variable[2], y_title, "Ratio", square=CMS.kSquare, extraSpace=0.05, iPos=0 )
-        legend_ratio = CMS.cmsLeg(0.22, 0.65, 0.92, 0.88, textSize=0.025, columns=4)
-        
-        # Draw stack plot in the upper pad using cmsstyle
-        CMS.cmsDrawStack(stack_ratio, legend_ratio, histos_dict, data=(data_histos[variable[0]] if args.data else None))
-        if config_file.set_logy:
-            ROOT.gPad.SetLogy()
-            ROOT.gPad.Update()
-
-        # Change to the bottom pad
-        canvas_ratio.cd(2)
-        
-        # Sum all MC histograms to create the denominator
-        mc_total_hist = stack_ratio.GetStack().Last().Clone("mc_total_hist")  # Get the total stacked MC histogram
-        data_hist = data_histos[variable[0]]
-
-        # Compute the ratio Data/MC
-        ratio_hist = data_hist.Clone("ratio_hist")
-        ratio_hist.Divide(mc_total_hist)
-
-        # Style the ratio plot
-        ratio_hist.SetMarkerStyle(20)
-        ratio_hist.SetMarkerColor(ROOT.kBlack)
-        ratio_hist.SetLineColor(ROOT.kBlack)
-        # Format for Y axis
-        ratio_hist.GetYaxis().SetTitle("Data / MC")
-        ratio_hist.GetYaxis().SetTitleSize(0.13)
-        ratio_hist.GetYaxis().SetLabelSize(0.11)
-        ratio_hist.GetYaxis().SetTitleOffset(0.5)
-        ratio_hist.GetYaxis().SetRangeUser(0,2)
-        ratio_hist.GetYaxis().SetNdivisions(505)
-        # Format for X axis
-        ratio_hist.GetXaxis().SetTitle(variable[2])
-        ratio_hist.GetXaxis().SetTitleSize(0.13)
-        ratio_hist.GetXaxis().SetLabelSize(0.11)
-        # Draw with error bars
-        ratio_hist.Draw("EP")  
-
-        # Draw a horizontal line at y=1 for reference
-        line = ROOT.TLine(x_min, 1, x_max, 1)
-        line.SetLineStyle(2)
-        line.SetLineColor(ROOT.kBlack)
-        line.Draw("same")
-
-        # Save canvas
-        CMS.SaveCanvas(canvas_ratio,os.path.join(config_file.output_plots_dir, args.type, f"{variable[1]}_ratio." + config_file.plot_format), close= True)
+import columnar
+import fillspec
+import inputs
+import manifest
+import profiling
+import skim
 
-if __name__ == "__main__":
-    start_time = time.time()
+## ROOT and the modules built on it are imported by the ROOT fill and render stages only, --engine uproot runs without PyROOT
 
-    config_file = config.Config()
-    os.makedirs(os.path.join(config_file.output_plots_dir, args.type), exist_ok=True)
-
-    path_parts = os.path.normpath(config_file.base_dir).split(os.sep)
-    DATA_FILES = [
-        "EGamma_merged.root",
-        "MuonEG_merged.root",
-        "Muon_merged.root"
-    ]
-    if "2022" in path_parts:
-        DATA_FILES += [
-            "DoubleMuon_merged.root",
-            "SingleMuon_merged.root"
-        ]
+## same names as backends.BACKENDS
+BACKEND_NAMES = ["local", "dask", "multiprocessing"]
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs='?', choices=['all', 'fill', 'render', 'skim'], default='all',
+                        help='fill: write all histograms to the store, render: draw plots from the store, all: both, '
+                             'skim: write selected, slimmed copies of the inputs to config.skim_dir')
+    parser.add_argument('-t', '--type', type=str, help='Type of plots', choices=['stack', 'shape'], default='stack')
+    parser.add_argument('-d', '--data', type=str, help='Real data filename (optional)', default=None)
+    parser.add_argument('-s', '--store', type=str, help='Histogram store file (default: config.histogram_store)', default=None)
+    parser.add_argument('-b', '--backend', type=str, help='Fill backend (default: config.fill_backend)', choices=BACKEND_NAMES, default=None)
+    parser.add_argument('-e', '--engine', type=str, help='Fill engine (default: config.fill_engine), uproot fills with NumPy without the ROOT event loop', choices=['root', 'uproot'], default=None)
+    parser.add_argument('-j', '--render-jobs', type=int, help='Number of worker processes drawing canvases', default=1)
+    parser.add_argument('-n', '--max-events', type=int, help='Read only the first N entries of every input, for quick previews', default=None)
+    parser.add_argument('--entry-range', type=int, nargs=2, metavar=('BEGIN', 'END'), help='Read only the entries [BEGIN, END) of every input', default=None)
+    parser.add_argument('--memory-budget', type=float, help='Fill the samples in batches whose estimated memory fits this many MB (default: config.memory_budget_mb)', default=None)
+    parser.add_argument('--eras', type=str, nargs='*', help='Batch mode over config.eras (all of them without names), filled in one event loop, plus config.era_combinations', default=None)
+    parser.add_argument('--profile', action='store_true', help='Record per-stage timings, written as profile.json/profile.txt next to the plots')
+    parser.add_argument('--no-skim', action='store_true', help='Read the original inputs even if valid skims exist')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the histogram cache')
+    parser.add_argument('--rebuild', action='store_true', help='Refill every histogram and redraw every canvas, ignoring the run manifest and the cache entries')
+    return parser.parse_args()
+
+def setup_fill_runtime():
+    ## only the fill stage needs multi-threading and the C++ helpers
+    import ROOT
+    import cpplib
+    ROOT.gROOT.SetBatch(True)
+    ROOT.ROOT.EnableImplicitMT()  # Enable multi-threading for RDataFrame
+    with profiling.stage("load_cpp_functions"):
+        cpplib.load()
 
+def add_samples(config_file):
     # Samples will be stacked in this order
     
     config_file.add_sample(name="ggZZ", root_file="ggZZ_final_merged.root",cuts=1)
@@ -237,7 +68,366 @@ if __name__ == "__main__":
     config_file.add_sample(name="ttH", root_file="ttH_final_merged.root",cuts=1)
     config_file.add_sample(name="bbH", root_file="bbH_final_merged.root",cuts=1)
     # config_file.add_sample(name="Hc", root_file="Hc_tree.root",cuts=1)
-    create_plots(config_file)
+
+def entry_range(args):
+    """Global [begin, end) entry range of every input for quick previews, None reads everything."""
+    if args.entry_range:
+        return tuple(args.entry_range)
+    if args.max_events:
+        return (0, args.max_events)
+    return None
+
+def fill_tasks(config_file, args):
+    """One fill task per MC sample, plus the merged real data if provided."""
+    tasks = []
+    for sample, (root_file, cuts) in config_file.samples_dict.items():
+        tasks.append({"label": sample, "inputs": inputs.sample_inputs(config_file, sample, root_file), "cuts": cuts, "weighted": True})
+    data_files = inputs.data_inputs(config_file, args.data)
+    if data_files:
+        tasks.append({"label": fillspec.DATA_NAME, "inputs": data_files, "cuts": None, "weighted": False})
+    for task in tasks:
+        task["files"] = list(task["inputs"])
+        task["range"] = entry_range(args)
+    return tasks
+
+def count_entries(config_file, tasks, count=inputs.root_entries):
+    """Set the per-file and total entries of every task from the cached entry counts, missing ones are read with count."""
+    entry_counts = inputs.EntryCounts(os.path.join(config_file.cache_dir, "entries.json"), count)
+    for task in tasks:
+        task["file_entries"] = [entry_counts.get(path) for path in task["files"]]
+        task["entries"] = sum(task["file_entries"])
+    entry_counts.save()
+    print(f"[INFO] {sum(inputs.selected_entries(task) for task in tasks)} entries to read in {sum(len(task['files']) for task in tasks)} files")
+
+def histogram_specs(config_file):
+    """(plot name, expression, binning, variable) of every 1D and multi-dimensional histogram to fill, plus the sample yields."""
+    specs = [(variable[1], variable[0], variable[3:6], variable) for variable in config_file.vars + [fillspec.YIELDS_VARIABLE]]
+    specs += [(spec["name"], [axis[0] for axis in spec["axes"]], [axis[2:] for axis in spec["axes"]], spec) for spec in config_file.nd_vars]
+    return specs
+
+def plan_fill(config_file, args, store_path):
+    """Collect the histograms that are unchanged in the store or cached, and the fill tasks for everything else."""
+    import histcache
+    import histstore
+    specs = histogram_specs(config_file)
+
+    cache = None
+    if not args.no_cache:
+        cache = histcache.HistogramCache(config_file.cache_dir, config_file.cache_max_size_mb, rebuild=args.rebuild)
+    run_manifest = manifest.RunManifest(store_path, ignore_existing=args.rebuild)
+
+    # Fingerprint of every (plot, sample) histogram: input files, selection, weights, expression and binning
+    all_tasks = fill_tasks(config_file, args)
+    # entry ranges refer to the original inputs, not to the selected events of a skim
+    if not args.no_skim and entry_range(args) is None:
+        skim.use_valid_skims(config_file, all_tasks)
+    cache_keys = {}
+    fingerprints = {}
+    task_labels = {}
+    for task in all_tasks:
+        # nominal histogram plus one per systematic variation, all filled in the same event loop
+        suffixes = [""]
+        weights = ""
+        if task["weighted"]:
+            suffixes += [suffix for _, suffix in fillspec.variations(config_file)]
+            weights = [config_file.weights, config_file.weight_variations, config_file.column_variations]
+        identity = histcache.HistogramCache.input_identity(task["inputs"])
+        for plot_name, expression, binning, _ in specs:
+            labels = []
+            for suffix in suffixes:
+                label = fillspec.variation_label(task["label"], suffix) if suffix else task["label"]
+                selection = [config_file.cut_stages, config_file.cuts, task["cuts"]] + ([["entry range", list(task["range"])]] if task["range"] else [])
+                if skim.skim_identity(task):
+                    # a histogram filled from a skim is cached apart from one filled from the original inputs
+                    selection.append(["skim", skim.skim_identity(task)])
+                key = histcache.HistogramCache.histogram_key(selection, [weights, suffix], expression, binning)
+                cache_keys[(plot_name, label)] = (task["inputs"], key)
+                fingerprints[(plot_name, label)] = manifest.fingerprint([identity, key])
+                labels.append(label)
+            task_labels[(task["label"], plot_name)] = labels
+
+    # Histograms whose inputs did not change since the last run are copied from the store untouched
+    fresh_keys = [key for key, value in fingerprints.items() if run_manifest.histogram_fresh(*key, value)]
+    stored = histstore.stored_keys(store_path) if fresh_keys else set()
+    reused = {key for key in fresh_keys if key in stored}
+
+    # Everything else is looked up in the cache, and only what is still missing is booked
+    filled = {}  # (plot name, sample) -> TH1
+    tasks = []
+    for task in all_tasks:
+        task["variables"] = []
+        task["nd_variables"] = []
+        for plot_name, _, _, variable in specs:
+            keys = [(plot_name, label) for label in task_labels[(task["label"], plot_name)]]
+            if all(key in reused for key in keys):
+                continue
+            # the labels of a variable are filled together, partly fresh ones come from the cache or the new fill
+            reused.difference_update(keys)
+            if cache:
+                hits = {}
+                for key in keys:
+                    hist = cache.load(*cache_keys[key])
+                    if hist is not None:
+                        hits[key] = hist
+                if len(hits) == len(keys):
+                    filled.update(hits)
+                    continue
+            task["nd_variables" if isinstance(variable, dict) else "variables"].append(variable)
+        # Only open the inputs that still have histograms to fill
+        if task["variables"] or task["nd_variables"]:
+            tasks.append(task)
+    print(f"[INFO] {len(reused)} histograms unchanged since the last run, {sum(len(task['variables']) + len(task['nd_variables']) for task in tasks)} (sample, variable) pairs to fill")
+
+
+    if tasks:
+        count_entries(config_file, tasks)
+    return {"store_path": store_path, "tasks": tasks, "reused": reused, "filled": filled, "cache": cache, "cache_keys": cache_keys,
+            "fingerprints": fingerprints, "run_manifest": run_manifest}
+
+def fold_filled(config_file, histos):
+    """Fold the flow bins of freshly filled or cached 1D histograms, multi-dimensional ones are stored raw and their projections folded when drawn."""
+    import histops
+    flat_names = {variable[1] for variable in config_file.vars}
+    with profiling.stage("fold_flow"):
+        histops.fold_flow([hist for (plot_name, _), hist in histos.items() if plot_name in flat_names], underflow=False, overflow=True)
+
+def begin_store(config_file, plan):
+    """Start the new store next to the old one with the reused and the cached histograms, the filled ones are added batch by batch."""
+    import histstore
+    store_path = plan["store_path"]
+    os.makedirs(os.path.dirname(store_path) or ".", exist_ok=True)
+    plan["new_store_path"] = store_path + ".new"
+    histstore.write_histograms(plan["new_store_path"], {})
+    plan["cutflow_written"] = False
+    # reused histograms are already post-processed
+    with profiling.stage("copy_reused"):
+        plan["stored"] = set(histstore.copy_histograms(store_path, plan["new_store_path"], sorted(plan["reused"])) if plan["reused"] else [])
+    fold_filled(config_file, plan["filled"])
+    histstore.write_histograms(plan["new_store_path"], plan["filled"], mode="UPDATE")
+    plan["stored"].update(plan["filled"])
+    plan["filled"] = {}
+
+def add_to_store(config_file, plan, new_histos, reports):
+    """Cache a batch of freshly filled histograms, post-process them and add them to the new store."""
+    import booking
+    import histstore
+    cache, cache_keys = plan["cache"], plan["cache_keys"]
+    if reports:
+        # a skim holds only selected events, its cut-flow starts after the skim selection
+        post_skim = {task["label"] for task in plan["tasks"] if skim.skim_identity(task)}
+        booking.write_cutflow(reports, os.path.join(os.path.dirname(plan["store_path"]) or ".", "cutflow.txt"), append=plan["cutflow_written"], post_skim=post_skim)
+        plan["cutflow_written"] = True
+    if not new_histos:
+        return
+    # Save the freshly filled histograms before any post-processing touches them
+    if cache:
+        new_entries = {}
+        for plot_name, label in new_histos:
+            input_paths, key = cache_keys[(plot_name, label)]
+            new_entries.setdefault(tuple(input_paths), {})[key] = new_histos[(plot_name, label)]
+        for input_paths, histos in new_entries.items():
+            cache.store(list(input_paths), histos)
+        cache.evict()
+    fold_filled(config_file, new_histos)
+    with profiling.stage("write_store"):
+        histstore.write_histograms(plan["new_store_path"], new_histos, mode="UPDATE")
+    plan["stored"].update(new_histos)
+
+def end_store(plan):
+    """Replace the old store by the new one and record it in the run manifest, returns the number of histograms."""
+    if plan["cache"]:
+        plan["cache"].summary()
+    os.replace(plan["new_store_path"], plan["store_path"])
+    print(f"[INFO] Wrote {len(plan['stored'])} histograms to {plan['store_path']}")
+    plan["run_manifest"].set_histograms({key: plan["fingerprints"][key] for key in plan["stored"]})
+    plan["run_manifest"].save()
+    return len(plan["stored"])
+
+def run_batches(config_file, args, tasks, store_batch):
+    """Run the fill backend on batches of tasks within the memory budget, every batch is handed to store_batch(histos, reports) and freed.
+
+    Returns the number of event loops run.
+    """
+    import backends
+    backend = backends.BACKENDS[args.backend or config_file.fill_backend]
+    batches = backends.memory_batches(config_file, tasks, args.memory_budget or config_file.memory_budget_mb)
+    nloops = 0
+    for i, batch in enumerate(batches):
+        if len(batches) > 1:
+            print(f"[INFO] Batch {i + 1}/{len(batches)}: {', '.join(task['label'] for task in batch)}")
+        with profiling.stage("fill_batch"):
+            new_histos, reports, batch_loops = backend(config_file, batch)
+            store_batch(new_histos, reports)
+        nloops += batch_loops
+        # the reports keep the computation graphs alive, and with them the per-thread partial histograms
+        del new_histos, reports
+        gc.collect()
+        if len(batches) > 1:
+            print(f"[INFO] Peak RSS so far: {profiling.peak_rss_mb():.0f} MB")
+    return nloops
+
+def fill_histograms(config_file, args, store_path):
+    """Fill every histogram that is neither unchanged in the store nor cached, write them all to the store, returns a short summary."""
+    plan = plan_fill(config_file, args, store_path)
+    begin_store(config_file, plan)
+    if not plan["tasks"]:
+        print("All histograms found in the store or the cache, no event loop needed")
+    nloops = run_batches(config_file, args, plan["tasks"], lambda new_histos, reports: add_to_store(config_file, plan, new_histos, reports))
+    return {"event_loops": nloops, "histograms": end_store(plan)}
+
+
+def fill_histograms_columnar(config_file, args, store_path):
+    """Fill every histogram with the uproot engine and write them all to the store, returns a short summary."""
+    tasks = fill_tasks(config_file, args)
+    for task in tasks:
+        # the sample yields are filled like a variable, as in the ROOT engine
+        task["variables"] = config_file.vars + [fillspec.YIELDS_VARIABLE]
+        task["nd_variables"] = []
+    if config_file.nd_vars:
+        print("[WARNING] The uproot engine fills only the 1D variables, use the ROOT engine for config.nd_vars")
+    if not args.no_skim and entry_range(args) is None:
+        skim.use_valid_skims(config_file, tasks)
+    count_entries(config_file, tasks, inputs.uproot_entries)
+    store_histos = columnar.fill_tasks(config_file, tasks)
+
+    os.makedirs(os.path.dirname(store_path) or ".", exist_ok=True)
+    columnar.write_histograms(store_path, store_histos)
+    print(f"[INFO] Wrote {len(store_histos)} histograms to {store_path}")
+    # not tracked by the run manifest, the next ROOT fill and render start from scratch
+    if os.path.exists(manifest.manifest_path(store_path)):
+        os.remove(manifest.manifest_path(store_path))
+    return {"event_loops": len(tasks), "histograms": len(store_histos)}
+
+## labels of the batch mode tasks are <era>@<label> while all eras share one event loop
+ERA_SEP = "@"
+
+def fill_eras(config_file, args, configs):
+    """Fill all eras with a single backend call per batch (one RunGraphs for the local backend), each era into its own store."""
+    plans = {}
+    tasks = []
+    for name, (era_config, era_args) in configs.items():
+        print(f"[INFO] Era {name}")
+        plans[name] = plan_fill(era_config, era_args, era_config.histogram_store)
+        begin_store(era_config, plans[name])
+        tasks += [dict(task, label=f"{name}{ERA_SEP}{task['label']}") for task in plans[name]["tasks"]]
+    if not tasks:
+        print("All histograms found in the stores or the cache, no event loop needed")
+
+    def store_batch(new_histos, reports):
+        era_histos = {name: {} for name in configs}
+        for (plot_name, label), hist in new_histos.items():
+            name, _, label = label.partition(ERA_SEP)
+            era_histos[name][(plot_name, label)] = hist
+        era_reports = {name: {} for name in configs}
+        for label, report in reports.items():
+            name, _, label = label.partition(ERA_SEP)
+            era_reports[name][label] = report
+        for name, (era_config, _) in configs.items():
+            add_to_store(era_config, plans[name], era_histos[name], era_reports[name])
+
+    nloops = run_batches(config_file, args, tasks, store_batch)
+    total = sum(end_store(plans[name]) for name in configs)
+    return {"event_loops": nloops, "histograms": total}
+
+def combined_configs(config_file):
+    """{combination name: (combined config, [era configs])} for every entry of config.era_combinations."""
+    era_configs = {era["name"]: config_file.era_config(era) for era in config_file.eras}
+    combined = {}
+    for name, members in config_file.era_combinations.items():
+        unknown = [member for member in members if member not in era_configs]
+        if unknown:
+            raise ValueError(f"Era combination {name} refers to unknown eras {unknown}")
+        members = [era_configs[member] for member in members]
+        combined[name] = (config_file.combined_config(name, members), members)
+    return combined
+
+def combine_eras(config_file):
+    """Sum the stores of the eras of every combination into its own store, without another event loop."""
+    import histstore
+    for name, (combined, members) in combined_configs(config_file).items():
+        missing = [member.histogram_store for member in members if not os.path.exists(member.histogram_store)]
+        if missing:
+            print(f"[WARNING] Cannot combine {name}, missing stores {missing}")
+            continue
+        totals = {}
+        fingerprints = {}
+        for member in members:
+            era_manifest = manifest.RunManifest(member.histogram_store)
+            for key, hist in histstore.read_all(member.histogram_store).items():
+                if key in totals:
+                    totals[key].Add(hist)
+                else:
+                    totals[key] = hist
+                fingerprints.setdefault(key, []).append(era_manifest.histograms.get(era_manifest.histogram_key(*key)))
+        os.makedirs(combined.output_plots_dir, exist_ok=True)
+        histstore.write_histograms(combined.histogram_store, totals)
+        print(f"[INFO] Wrote {len(totals)} histograms of {name} to {combined.histogram_store}")
+
+        # the combination is unchanged when all its era histograms are, unknown era histograms always redraw
+        combined_manifest = manifest.RunManifest(combined.histogram_store, ignore_existing=True)
+        if all(None not in values for values in fingerprints.values()):
+            combined_manifest.set_histograms({key: manifest.fingerprint(values) for key, values in fingerprints.items()})
+            combined_manifest.save()
+        elif os.path.exists(combined_manifest.path):
+            os.remove(combined_manifest.path)
+
+def run_eras(config_file, args):
+    """Batch mode: every selected era of config.eras in one process, filled in one event loop, plus the combined eras."""
+    selected = [era for era in config_file.eras if not args.eras or era["name"] in args.eras]
+    if not selected:
+        raise ValueError("No era selected, fill config.eras or check the --eras names")
+    configs = {}
+    for era in selected:
+        era_args = argparse.Namespace(**dict(vars(args), data=era.get("data_dir")))
+        configs[era["name"]] = (config_file.era_config(era), era_args)
+
+    if args.command == "skim":
+        setup_fill_runtime()
+        for era_config, era_args in configs.values():
+            skim.make_skims(era_config, fill_tasks(era_config, era_args))
+    if args.command in ("all", "fill"):
+        if (args.engine or config_file.fill_engine) == "uproot":
+            for era_config, era_args in configs.values():
+                fill_histograms_columnar(era_config, era_args, era_config.histogram_store)
+        else:
+            setup_fill_runtime()
+            fill_eras(config_file, args, configs)
+        combine_eras(config_file)
+    if args.command in ("all", "render"):
+        import render
+        to_render = [era_config for era_config, _ in configs.values()]
+        to_render += [combined for combined, _ in combined_configs(config_file).values() if os.path.exists(combined.histogram_store)]
+        for render_config in to_render:
+            render.render_plots(render_config, render_config.histogram_store, args.type, jobs=args.render_jobs, rebuild=args.rebuild)
+
+if __name__ == "__main__":
+    start_time = time.time()
+    args = parse_args()
+
+    if args.profile:
+        profiling.enable()
+
+    config_file = config.Config()
+    add_samples(config_file)
+    store_path = args.store or config_file.histogram_store
+
+    if args.eras is not None:
+        run_eras(config_file, args)
+    else:
+        if args.command == "skim":
+            setup_fill_runtime()
+            skim.make_skims(config_file, fill_tasks(config_file, args))
+        if args.command in ("all", "fill"):
+            if (args.engine or config_file.fill_engine) == "uproot":
+                fill_histograms_columnar(config_file, args, store_path)
+            else:
+                setup_fill_runtime()
+                fill_histograms(config_file, args, store_path)
+        if args.command in ("all", "render"):
+            import render
+            render.render_plots(config_file, store_path, args.type, jobs=args.render_jobs, rebuild=args.rebuild)
+
+    profiling.write(config_file.output_plots_dir)
 
     end_time = time.time()
     print(f"Elapsed time: {(end_time - start_time)/60:.2f} minutes")
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+
+## Run manifest stored next to the histogram store. It records the fingerprint of the exact inputs that produced
+## every stored histogram and every drawn canvas, so that the next run only refills and redraws what changed.
+
+def manifest_path(store_path):
+    return os.path.splitext(store_path)[0] + "_manifest.json"
+
+def fingerprint(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+class RunManifest:
+
+    def __init__(self, store_path, ignore_existing=False):
+        self.path = manifest_path(store_path)
+        self.histograms = {}  # "<plot name>/<label>" -> fingerprint
+        self.canvases = {}  # "<plot type>/<plot name>" -> fingerprint
+        if not ignore_existing and os.path.exists(self.path):
+            with open(self.path) as f:
+                content = json.load(f)
+            self.histograms = content.get("histograms", {})
+            self.canvases = content.get("canvases", {})
+
+    @staticmethod
+    def histogram_key(plot_name, label):
+        return f"{plot_name}/{label}"
+
+    def histogram_fresh(self, plot_name, label, histogram_fingerprint):
+        return self.histograms.get(self.histogram_key(plot_name, label)) == histogram_fingerprint
+
+    def set_histograms(self, fingerprints):
+        """Replace the histogram records by {(plot name, label): fingerprint} of the store just written."""
+        self.histograms = {self.histogram_key(plot_name, label): value for (plot_name, label), value in fingerprints.items()}
+
+    def plot_fingerprints(self, plot_name):
+        """Fingerprints of every stored histogram of one plot, the input of its canvases."""
+        prefix = plot_name + "/"
+        return {key: value for key, value in self.histograms.items() if key.startswith(prefix)}
+
+    def canvas_fresh(self, key, canvas_fingerprint, outputs):
+        return self.canvases.get(key) == canvas_fingerprint and all(os.path.exists(output) for output in outputs)
+
+    def set_canvas(self, key, canvas_fingerprint):
+        self.canvases[key] = canvas_fingerprint
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"histograms": self.histograms, "canvases": self.canvases}, f, indent=2, sort_keys=True)
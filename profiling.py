@@ -0,0 +1,123 @@
+import contextlib
+import json
+import os
+import resource
+import time
+
+## Per-stage timing records, only collected when enabled with --profile.
+## Records are {"stage", "sample", "variable", "seconds", "peak_rss_mb"}, inputs are {label: {"events", "bytes_read_estimate", ...}},
+## totals hold the measured values of the whole run, e.g. "bytes_read".
+## Stages can be nested: event_loop includes jit_graphs, draw_stack/draw_ratio include save_canvas.
+## The peak RSS of a stage is the high-water mark of the process while it ran, on Linux the mark is reset when
+## a stage starts, elsewhere it is the peak since the process started.
+
+_state = {"enabled": False, "records": [], "inputs": {}, "totals": {}, "stack": [], "peak_rss_mb": 0.0}
+
+def enable():
+    _state["enabled"] = True
+
+def enabled():
+    return _state["enabled"]
+
+def _high_water_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _reset_high_water():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    """Peak RSS of the process so far in MB, unaffected by the per-stage resets."""
+    _state["peak_rss_mb"] = max(_state["peak_rss_mb"], _high_water_mb())
+    return _state["peak_rss_mb"]
+
+@contextlib.contextmanager
+def stage(name, sample=None, variable=None):
+    if not _state["enabled"]:
+        yield
+        return
+    # the enclosing stages keep the peak reached so far before the mark is reset for this one
+    current = _high_water_mb()
+    peak_rss_mb()
+    for frame in _state["stack"]:
+        frame["peak"] = max(frame["peak"], current)
+    _reset_high_water()
+    frame = {"peak": 0.0}
+    _state["stack"].append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = max(frame["peak"], _high_water_mb())
+        peak_rss_mb()
+        _state["stack"].pop()
+        if _state["stack"]:
+            _state["stack"][-1]["peak"] = max(_state["stack"][-1]["peak"], peak)
+        record(name, seconds, sample, variable, peak_mb=peak)
+
+def record(name, seconds, sample=None, variable=None, peak_mb=None):
+    if _state["enabled"]:
+        _state["records"].append({"stage": name, "sample": sample, "variable": variable, "seconds": seconds, "peak_rss_mb": peak_mb})
+
+def pop_records():
+    """Return and clear the records collected so far in this process."""
+    collected = _state["records"]
+    _state["records"] = []
+    return collected
+
+def add_records(new_records):
+    """Merge records collected in another process (e.g. a rendering worker)."""
+    if _state["enabled"]:
+        _state["records"].extend(new_records)
+
+def set_input(label, **info):
+    if _state["enabled"]:
+        _state["inputs"].setdefault(label, {}).update(info)
+
+def set_total(name, value):
+    if _state["enabled"]:
+        _state["totals"][name] = value
+
+def summary_table():
+    """Short text table: time and peak RSS per stage, then events and estimated bytes per input, then the measured totals."""
+    stages = {}
+    for rec in _state["records"]:
+        entry = stages.setdefault(rec["stage"], [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += rec["seconds"]
+        entry[2] = max(entry[2], rec.get("peak_rss_mb") or 0.0)
+    lines = [f"{'stage':<24}{'calls':>8}{'total [s]':>12}{'mean [ms]':>12}{'peak RSS [MB]':>15}"]
+    for name, (calls, seconds, peak) in sorted(stages.items(), key=lambda item: -item[1][1]):
+        lines.append(f"{name:<24}{calls:>8}{seconds:>12.3f}{1000 * seconds / calls:>12.2f}{peak:>15.1f}")
+    if _state["inputs"]:
+        lines.append("")
+        lines.append(f"{'input':<24}{'events':>14}{'MB read (est.)':>16}")
+        for label, info in _state["inputs"].items():
+            lines.append(f"{label:<24}{info.get('events', 0):>14}{info.get('bytes_read_estimate', 0) / 1e6:>16.1f}")
+    for name, value in _state["totals"].items():
+        lines.append(f"{name}: {value}")
+    return "\n".join(lines)
+
+def write(directory):
+    if not _state["enabled"]:
+        return
+    set_total("peak_rss_mb", round(peak_rss_mb(), 1))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "profile.json"), "w") as f:
+        json.dump({"records": _state["records"], "inputs": _state["inputs"], "totals": _state["totals"]}, f, indent=2)
+    table = summary_table()
+    with open(os.path.join(directory, "profile.txt"), "w") as f:
+        f.write(table + "\n")
+    print(table)
+    print(f"[INFO] Profile written to {os.path.join(directory, 'profile.json')}")
@@ -0,0 +1,433 @@
+import ROOT
+import csv
+import multiprocessing
+import numpy as np
+import os
+import cmsstyle as CMS  # Import cmsstyle
+import fillspec
+import histops
+import histstore
+import manifest
+import profiling
+
+## Drawing only: nothing here needs the compiled C++ helpers or implicit MT
+
+def setup_style(config_file):
+    ROOT.gStyle.SetLegendBorderSize(0)
+    ROOT.gStyle.SetPadLeftMargin(0.15)
+    ROOT.gStyle.SetTitleYOffset(1.5)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetTextSize(0.035)
+    ROOT.gStyle.SetGridStyle(2)
+    ROOT.gStyle.SetGridColor(ROOT.kGray+2)
+    ROOT.gStyle.SetGridWidth(1)
+    # cmsstyle forces its style on every histogram read afterwards, set it before the first read so that
+    # every variable starts from the same state in the serial loop and in the rendering workers
+    CMS.setCMSStyle()
+    # CMS Styling Settings
+    CMS.SetExtraText("Preliminary")
+    CMS.SetLumi(config_file.dataset_legend)
+    CMS.SetEnergy(config_file.energy)
+    CMS.ResetAdditionalInfo()
+
+def projection_variable(spec, projection):
+    """1D variable entry, as in config.vars, of a projection of a multi-dimensional histogram."""
+    axis = spec["axes"][projection["axis"]]
+    slices = "".join(f"_{i}_{low:g}to{high:g}" for i, (low, high) in sorted(projection.get("slices", {}).items()))
+    name = projection.get("name") or f"{spec['name']}_proj{projection['axis']}{slices}"
+    binning = [axis[2]] if isinstance(axis[2], list) else list(axis[2:5])
+    return [axis[0], name, axis[1]] + binning
+
+def plot_items(config_file):
+    """Every 1D plot to draw as (variable, source): source is None for config.vars, (spec, projection) for config.nd_vars."""
+    items = [(variable, None) for variable in config_file.vars]
+    for spec in config_file.nd_vars:
+        for projection in spec.get("projections", []):
+            items.append((projection_variable(spec, projection), (spec, projection)))
+    return items
+
+def stored_name(variable, source):
+    return variable[1] if source is None else source[0]["name"]
+
+def load_variable(config_file, store_path, variable, source=None):
+    """Read one variable from the histogram store, MC samples in stacking order plus data (or None)."""
+    stored = histstore.read_variable(store_path, stored_name(variable, source))
+    if source is not None:
+        # projections are made from the raw stored histograms, then folded like the 1D variables
+        spec, projection = source
+        stored = {label: histops.project(hist, projection["axis"], projection.get("slices", {}), f"{variable[1]}_{label}") for label, hist in stored.items()}
+        histops.fold_flow(stored.values())
+    histos_dict = {sample: stored[sample] for sample in config_file.samples_dict if sample in stored}
+    data_hist = stored.get(fillspec.DATA_NAME)
+    variations = {}  # variation -> {sample: TH1}
+    for name, hist in stored.items():
+        sample, sep, suffix = name.partition(fillspec.VARIATION_SEP)
+        if sep and sample in histos_dict:
+            variations.setdefault(suffix, {})[sample] = hist
+    return histos_dict, data_hist, variations
+
+def prepare_variable(config_file, variable, histos_dict, data_hist, variations, plot_type):
+    """Display binning from config.render_binning, unit area for the shape plots and the data style.
+
+    Returns the variable entry with the drawn binning and the histograms to draw, the stored ones are not modified.
+    """
+    edges = config_file.render_binning.get(variable[1])
+    if edges:
+        histos_dict = dict(zip(histos_dict, histops.rebin(histos_dict.values(), edges)))
+        variations = {suffix: dict(zip(varied, histops.rebin(varied.values(), edges))) for suffix, varied in variations.items()}
+        if data_hist is not None:
+            data_hist = histops.rebin([data_hist], edges)[0]
+        variable = variable[:3] + [list(edges)]
+    if plot_type == "shape":
+        # every sample and every variation on its own, data included
+        histops.normalize(list(histos_dict.values()) + [hist for varied in variations.values() for hist in varied.values()])
+        if data_hist is not None:
+            histops.normalize([data_hist])
+    if data_hist is not None:
+        data_hist.SetMarkerStyle(20)
+        data_hist.SetMarkerColor(ROOT.kBlack)
+        if plot_type != "shape":
+            # unweighted counts: asymmetric Poisson (Garwood) errors instead of sqrt(N)
+            data_hist.Sumw2(False)
+            data_hist.SetBinErrorOption(ROOT.TH1.kPoisson)
+    return variable, histos_dict, data_hist, variations
+
+def band_graph(nominal, down, up, fill_style, color):
+    """Hatched band of asymmetric errors around the contents of a histogram, drawn with option "2"."""
+    content = histops.contents(nominal)[1:-1].astype("d")
+    edges = histops.bin_edges(nominal)
+    half_width = np.diff(edges) / 2
+    band = ROOT.TGraphAsymmErrors(len(content), edges[:-1] + half_width, content, half_width, half_width, np.ascontiguousarray(down, dtype="d"), np.ascontiguousarray(up, dtype="d"))
+    band.SetFillStyle(fill_style)
+    band.SetFillColor(color)
+    band.SetLineWidth(0)
+    band.SetMarkerSize(0)
+    return band
+
+def systematic_band(histos_dict, variations):
+    """Envelope of all variations around the nominal MC total, None if no variations were filled."""
+    if not variations:
+        return None
+    nominal = histops.stack_total(histos_dict.values(), "mc_nominal")
+    # samples without a given variation enter the varied total with their nominal histogram
+    totals = [histops.contents(histops.stack_total([varied.get(sample, hist) for sample, hist in histos_dict.items()], f"mc_{suffix}"))[1:-1] for suffix, varied in variations.items()]
+    content = histops.contents(nominal)[1:-1].astype("d")
+    shifts = np.array(totals, dtype="d") - content
+    up = np.maximum(shifts.max(axis=0), 0)
+    down = np.maximum(-shifts.min(axis=0), 0)
+    return band_graph(nominal, down, up, 3354, ROOT.kGray + 2)
+
+def stat_band(mc_total):
+    """MC statistical uncertainty, sqrt of the sum of squared weights of the MC total in every bin."""
+    error = np.sqrt(histops.sumw2(mc_total)[1:-1])
+    return band_graph(mc_total, error, error, 3345, ROOT.kBlack)
+
+def relative_band(band):
+    """Same band divided by the nominal MC total, drawn around 1 in the ratio panel."""
+    ratio = band.Clone("relative_band")
+    for i in range(band.GetN()):
+        content = band.GetPointY(i)
+        scale = 1 / content if content > 0 else 0
+        ratio.SetPoint(i, band.GetPointX(i), 1)
+        ratio.SetPointError(i, band.GetErrorXlow(i), band.GetErrorXhigh(i), band.GetErrorYlow(i) * scale, band.GetErrorYhigh(i) * scale)
+    return ratio
+
+def data_ratio(data_hist, mc_total):
+    """Data / MC total as points with the Poisson data errors only, the MC uncertainties are drawn as bands. Bins without MC are left out."""
+    counts = histops.contents(data_hist)[1:-1].astype("d")
+    mc = histops.contents(mc_total)[1:-1].astype("d")
+    low, up = histops.poisson_errors(counts)
+    edges = histops.bin_edges(mc_total)
+    keep = mc > 0
+    centers = (edges[:-1] + np.diff(edges) / 2)[keep]
+    zeros = np.zeros(len(centers))
+    mc = mc[keep]
+    graph = ROOT.TGraphAsymmErrors(len(centers), centers, counts[keep] / mc, zeros, zeros, low[keep] / mc, up[keep] / mc)
+    graph.SetMarkerStyle(20)
+    graph.SetMarkerColor(ROOT.kBlack)
+    graph.SetLineColor(ROOT.kBlack)
+    return graph
+
+def weighted_ratio(data_hist, mc_total, normalized):
+    """Data / MC total for data whose errors are not Poisson-only (e.g. normalized), with the data errors propagated.
+
+    With normalized data the MC total is normalized as well, the MC uncertainties are drawn as bands.
+    """
+    reference = mc_total
+    if normalized:
+        reference = mc_total.Clone("mc_shape")
+        reference.SetDirectory(0)
+        histops.normalize([reference])
+    ratio_hist = histops.ratio(data_hist, reference, "data_ratio", denominator_errors=False)
+    ratio_hist.SetMarkerStyle(20)
+    ratio_hist.SetMarkerColor(ROOT.kBlack)
+    ratio_hist.SetLineColor(ROOT.kBlack)
+    return ratio_hist
+
+## goodness-of-fit table columns, one row per plot, empty data columns when there is no data
+FIT_COLUMNS = ["plot", "mc_yield", "mc_stat_unc", "mc_effective_entries", "data_events", "chi2_ndf", "chi2_pvalue", "ks_pvalue"]
+
+def fit_summary(variable, data_hist, mc_total):
+    """Row of the goodness-of-fit table: MC yield and effective entries, data yield, chi2 and Kolmogorov-Smirnov tests of data vs MC."""
+    mc_yield = histops.contents(mc_total)[1:-1].sum()
+    mc_sumw2 = histops.sumw2(mc_total)[1:-1].sum()
+    row = dict.fromkeys(FIT_COLUMNS, "")
+    row.update(plot=variable[1], mc_yield=f"{mc_yield:.6g}", mc_stat_unc=f"{np.sqrt(mc_sumw2):.6g}", mc_effective_entries=f"{mc_yield ** 2 / mc_sumw2 if mc_sumw2 > 0 else 0:.6g}")
+    if data_hist is None:
+        return row
+    data_events = histops.contents(data_hist)[1:-1].sum()
+    row["data_events"] = f"{data_events:.0f}"
+    if data_events > 0 and mc_yield > 0:
+        # MC weighted, data unweighted unless it was normalized
+        option = "UW" if data_hist.GetBinErrorOption() == ROOT.TH1.kPoisson else "WW"
+        row["chi2_ndf"] = f"{data_hist.Chi2Test(mc_total, option + ' CHI2/NDF'):.6g}"
+        row["chi2_pvalue"] = f"{data_hist.Chi2Test(mc_total, option):.6g}"
+        row["ks_pvalue"] = f"{data_hist.KolmogorovTest(mc_total):.6g}"
+    return row
+
+def draw_stack(config_file, variable, histos_dict, data_hist, plot_type, mc_total, band=None):
+    # CMSStyle Canvas
+    canv_name = f"{variable[1]}_canvas"
+    y_title = "Events"
+    if isinstance(variable[3], list):  # Variable binning
+        x_min, x_max = variable[3][0], variable[3][-1]  # Use first and last bin edge
+    else:  # Uniform binning
+        x_min, x_max = variable[4], variable[5]  # Use configured range
+    canvas = CMS.cmsCanvas(canv_name, x_min, x_max, 0, 1, variable[2], y_title, square=CMS.kSquare, extraSpace=0.05, iPos=0)
+
+    # Define different stack plots for each case
+    stack = ROOT.THStack("stack", f";{variable[2]};{y_title}")
+    stack_temp = ROOT.THStack("stack_temp", f";{variable[2]};{y_title}")
+
+    legend = CMS.cmsLeg(0.22, 0.65, 0.92, 0.88, textSize=0.025, columns=4)
+
+    for sample, hist in histos_dict.items():
+        stack_temp.Add(hist)
+
+    # Adjust y-axis offsets and log scaling
+    y_max = 1
+    y_min = 0.0
+    if config_file.set_logy:
+        canvas.SetLogy()
+        y_max = 10 * CMS.cmsReturnMaxY(stack_temp)
+        y_min = 0.1
+    # elif config_file.set_logy:
+    #     y_max = 2.5 * CMS.cmsReturnMaxY(stack_temp)
+    else:
+        y_max = 1.2* CMS.cmsReturnMaxY(stack_temp)
+
+    # Set the CMS canvas y-axis
+    CMS.GetcmsCanvasHist(canvas).GetYaxis().SetRangeUser(y_min, y_max)
+    CMS.GetcmsCanvasHist(canvas).GetYaxis().SetTitleOffset(1.6)
+
+    scientific_notation = False
+    # Scientific notation
+    if scientific_notation:
+        hdf = CMS.GetcmsCanvasHist(canvas)
+        hdf.GetYaxis().SetMaxDigits(2)
+        # Shift multiplier position
+        ROOT.TGaxis.SetExponentOffset(-0.10, 0.01, "Y")
+
+    # Draw stack plot with cmsstyle
+    CMS.cmsDrawStack(stack, legend, histos_dict, data=data_hist)
+    mc_stat = stat_band(mc_total)
+    mc_stat.Draw("2 same")
+    legend.AddEntry(mc_stat, "MC stat. unc.", "f")
+    if band is not None:
+        band.Draw("2 same")
+        legend.AddEntry(band, "Syst. unc.", "f")
+
+    # Save canvas
+    with profiling.stage("save_canvas", variable=variable[1]):
+        CMS.SaveCanvas(canvas,os.path.join(config_file.output_plots_dir, plot_type, f"{variable[1]}." + config_file.plot_format), close= True)
+    return x_min, x_max, y_min, y_max
+
+def draw_ratio(config_file, variable, histos_dict, data_hist, plot_type, x_min, x_max, y_min, y_max, mc_total, band=None):
+    y_title = "Events"
+
+    # CMSStyle DiCanvas
+    canv_name_ratio = f"{variable[1]}_canvas_ratio"
+    canvas_ratio = CMS.cmsDiCanvas(canv_name_ratio, x_min, x_max, y_min, y_max, 0, 2, variable[2], y_title, "Ratio", square=CMS.kSquare, extraSpace=0.05, iPos=0 )
+    legend_ratio = CMS.cmsLeg(0.22, 0.65, 0.92, 0.88, textSize=0.025, columns=4)
+    stack_ratio = ROOT.THStack("stack_ratio", f";{variable[2]};{y_title}")
+
+    # Draw stack plot in the upper pad using cmsstyle
+    CMS.cmsDrawStack(stack_ratio, legend_ratio, histos_dict, data=data_hist)
+    mc_stat = stat_band(mc_total)
+    mc_stat.Draw("2 same")
+    legend_ratio.AddEntry(mc_stat, "MC stat. unc.", "f")
+    if band is not None:
+        band.Draw("2 same")
+        legend_ratio.AddEntry(band, "Syst. unc.", "f")
+    if config_file.set_logy:
+        ROOT.gPad.SetLogy()
+        ROOT.gPad.Update()
+
+    # Change to the bottom pad
+    canvas_ratio.cd(2)
+
+    # Empty frame of the ratio panel, also drawn without data. A new histogram instead of a clone of the MC total,
+    # which would carry axis attributes over from the store reads and the earlier variables
+    edges = histops.bin_edges(mc_total)
+    ratio_frame = ROOT.TH1D("ratio_frame", "", len(edges) - 1, edges)
+    ratio_frame.SetDirectory(0)
+    # Format for Y axis
+    ratio_frame.GetYaxis().SetTitle("Data / MC")
+    ratio_frame.GetYaxis().SetTitleSize(0.13)
+    ratio_frame.GetYaxis().SetLabelSize(0.11)
+    ratio_frame.GetYaxis().SetTitleOffset(0.5)
+    ratio_frame.GetYaxis().SetRangeUser(0,2)
+    ratio_frame.GetYaxis().SetNdivisions(505)
+    # Format for X axis
+    ratio_frame.GetXaxis().SetTitle(variable[2])
+    ratio_frame.GetXaxis().SetTitleSize(0.13)
+    ratio_frame.GetXaxis().SetLabelSize(0.11)
+    ratio_frame.Draw("AXIS")
+
+    # MC uncertainties relative to the MC total around 1
+    ratio_stat = relative_band(mc_stat)
+    ratio_stat.Draw("2 same")
+    if band is not None:
+        ratio_band = relative_band(band)
+        ratio_band.Draw("2 same")
+
+    # Data/MC with the Poisson data errors, or the propagated errors of weighted or normalized data
+    if data_hist is not None:
+        if data_hist.GetBinErrorOption() == ROOT.TH1.kPoisson:
+            ratio_graph = data_ratio(data_hist, mc_total)
+            ratio_graph.Draw("P same")
+        else:
+            ratio_graph = weighted_ratio(data_hist, mc_total, normalized=(plot_type == "shape"))
+            ratio_graph.Draw("E same")
+
+    # Draw a horizontal line at y=1 for reference
+    line = ROOT.TLine(x_min, 1, x_max, 1)
+    line.SetLineStyle(2)
+    line.SetLineColor(ROOT.kBlack)
+    line.Draw("same")
+
+    # Save canvas
+    with profiling.stage("save_canvas", variable=variable[1]):
+        CMS.SaveCanvas(canvas_ratio,os.path.join(config_file.output_plots_dir, plot_type, f"{variable[1]}_ratio." + config_file.plot_format), close= True)
+
+def render_variable(config_file, store_path, variable, plot_type, source=None):
+    """Draw the stack and the ratio canvas of one variable, returns its goodness-of-fit row (None if nothing was stored)."""
+    print(f"Plotting var {variable[0]}")
+    # fresh style for every variable, nothing set while drawing the previous ones carries over
+    setup_style(config_file)
+    with profiling.stage("read_store", variable=variable[1]):
+        histos_dict, data_hist, variations = load_variable(config_file, store_path, variable, source)
+    if not histos_dict:
+        print(f"[WARNING] No histograms for {variable[1]} in {store_path}, skipping")
+        return None
+    variable, histos_dict, data_hist, variations = prepare_variable(config_file, variable, histos_dict, data_hist, variations, plot_type)
+    band = systematic_band(histos_dict, variations)
+    # Sum all MC histograms: statistical band and denominator of the ratio
+    mc_total = histops.stack_total(histos_dict.values(), "mc_total_hist")
+    with profiling.stage("draw_stack", variable=variable[1]):
+        x_min, x_max, y_min, y_max = draw_stack(config_file, variable, histos_dict, data_hist, plot_type, mc_total, band)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    # Ratio plots, without data only the MC uncertainty bands
+    #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    with profiling.stage("draw_ratio", variable=variable[1]):
+        draw_ratio(config_file, variable, histos_dict, data_hist, plot_type, x_min, x_max, y_min, y_max, mc_total, band)
+    return fit_summary(variable, data_hist, mc_total)
+
+## per-process state of the rendering workers, set once by _init_worker
+_worker_state = {}
+
+def _init_worker(config_file, store_path, plot_type, profile):
+    # every worker is a fresh process with its own ROOT and cmsstyle state
+    ROOT.gROOT.SetBatch(True)
+    if profile:
+        profiling.enable()
+    _worker_state.update(config_file=config_file, store_path=store_path, plot_type=plot_type)
+
+def _render_worker(item):
+    variable, source = item
+    row = render_variable(_worker_state["config_file"], _worker_state["store_path"], variable, _worker_state["plot_type"], source)
+    return row, profiling.pop_records()
+
+def canvas_outputs(config_file, variable, plot_type):
+    return [os.path.join(config_file.output_plots_dir, plot_type, f"{variable[1]}{suffix}." + config_file.plot_format) for suffix in ("", "_ratio")]
+
+def write_fit_table(path, rows, plot_names):
+    """Update the goodness-of-fit CSV with the rows of the plots just drawn, the rows of unchanged plots are kept."""
+    table = {}
+    if os.path.exists(path):
+        with open(path, newline="") as f:
+            table = {row["plot"]: row for row in csv.DictReader(f)}
+    table.update((row["plot"], row) for row in rows)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(table[name] for name in plot_names if name in table)
+    print(f"[INFO] Goodness-of-fit table written to {path}")
+
+def write_yields(config_file, store_path):
+    """Per-sample yield, sum of squared weights, entries and effective entries from the store as a CSV next to the plots."""
+    stored = histstore.read_variable(store_path, fillspec.YIELDS_NAME)
+    if not stored:
+        return
+    path = os.path.join(config_file.output_plots_dir, "sample_yields.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sample", "entries", "yield", "sumw2", "effective_entries"])
+        for sample in list(config_file.samples_dict) + [fillspec.DATA_NAME]:
+            hist = stored.get(sample)
+            if hist is None:
+                continue
+            sumw, sumw2 = histops.contents(hist)[1], histops.sumw2(hist)[1]
+            writer.writerow([sample, f"{hist.GetEntries():.0f}", f"{sumw:.6g}", f"{sumw2:.6g}", f"{sumw ** 2 / sumw2 if sumw2 > 0 else 0:.6g}"])
+    print(f"[INFO] Sample yields written to {path}")
+
+def canvas_fingerprint(config_file, variable, source, plot_type, histogram_fingerprints):
+    """Everything a canvas depends on: its stored histograms, the variable, the cosmetic settings and this drawing code."""
+    with open(os.path.abspath(__file__), "rb") as f:
+        code = f.read().decode(errors="replace")
+    cosmetics = [config_file.set_logy, config_file.dataset_legend, config_file.energy, config_file.plot_format, plot_type, list(config_file.samples_dict), config_file.render_binning.get(variable[1])]
+    return manifest.fingerprint([histogram_fingerprints, variable, source, cosmetics, code])
+
+def render_plots(config_file, store_path, plot_type, jobs=1, rebuild=False):
+    ROOT.gROOT.SetBatch(True)
+    os.makedirs(os.path.join(config_file.output_plots_dir, plot_type), exist_ok=True)
+
+    # Only redraw the canvases whose histograms or settings changed since the last run
+    run_manifest = manifest.RunManifest(store_path)
+    all_items = plot_items(config_file)
+    items = []
+    canvas_fingerprints = {}
+    for variable, source in all_items:
+        histogram_fingerprints = run_manifest.plot_fingerprints(stored_name(variable, source))
+        key = f"{plot_type}/{variable[1]}"
+        fingerprint = canvas_fingerprint(config_file, variable, source, plot_type, histogram_fingerprints)
+        # without a manifest entry the store was not written by the fill stage, always draw
+        if not rebuild and histogram_fingerprints and run_manifest.canvas_fresh(key, fingerprint, canvas_outputs(config_file, variable, plot_type)):
+            continue
+        items.append((variable, source))
+        if histogram_fingerprints:
+            canvas_fingerprints[key] = fingerprint
+    skipped = len(all_items) - len(items)
+    if skipped:
+        print(f"[INFO] {skipped} canvases unchanged since the last run, drawing {len(items)}")
+
+    rows = []
+    if jobs > 1 and items:
+        # spawn instead of fork: the parent may already run ROOT's thread pool from the fill stage
+        print(f"[INFO] Rendering {len(items)} variables with {jobs} worker processes")
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(jobs, initializer=_init_worker, initargs=(config_file, store_path, plot_type, profiling.enabled())) as pool:
+            for row, worker_records in pool.imap_unordered(_render_worker, items):
+                rows.append(row)
+                profiling.add_records(worker_records)
+    elif items:
+        for variable, source in items:
+            rows.append(render_variable(config_file, store_path, variable, plot_type, source))
+    write_fit_table(os.path.join(config_file.output_plots_dir, plot_type, "goodness_of_fit.csv"), [row for row in rows if row], [variable[1] for variable, _ in all_items])
+    write_yields(config_file, store_path)
+
+    for key, fingerprint in canvas_fingerprints.items():
+        run_manifest.set_canvas(key, fingerprint)
+    if canvas_fingerprints:
+        run_manifest.save()
@@ -0,0 +1,106 @@
+import json
+import os
+import fillspec
+import histcache
+import utils
+
+## Skims are per-sample Snapshot files in config.skim_dir holding only the selected events and the branches
+## the configured variables, weights and cuts read. A JSON manifest next to each skim records what it was made from.
+## Only make_skims needs ROOT, finding the valid skims also works for the uproot engine.
+
+def skim_files(config_file, task):
+    base = os.path.join(config_file.skim_dir, task["label"])
+    return base + ".root", base + ".json"
+
+def selection(config_file, task):
+    return [config_file.cut_stages, str(config_file.cuts), task["cuts"]]
+
+def required_columns(config_file, task, columns):
+    """Branches of the input tree referenced by any configured expression of this task."""
+    full_task = dict(task, variables=config_file.vars, nd_variables=config_file.nd_vars)
+    return utils.referenced_columns(fillspec.task_expressions(config_file, full_task), columns)
+
+def varied_cut_columns(config_file, task):
+    """Columns with a column variation that a cut of this task reads.
+
+    A skim made with the nominal cuts lacks the events that pass only a varied cut, so such tasks are never skimmed.
+    """
+    if not task["weighted"] or not config_file.column_variations:
+        return []
+    cuts = [config_file.cuts, task["cuts"]] + [expression for _, expression in config_file.cut_stages]
+    return utils.referenced_columns([cut for cut in cuts if cut is not None], [column for column, _ in config_file.column_variations.values()])
+
+def skim_identity(task):
+    """Identity of the skim a task reads, None for the original inputs, part of the histogram cache keys."""
+    if task["files"] == task["inputs"]:
+        return None
+    return histcache.HistogramCache.input_identity(task["files"])
+
+def valid_skim(config_file, task):
+    """Path of a skim usable for this task, None if it is missing, stale or unsafe with the column variations."""
+    if varied_cut_columns(config_file, task):
+        return None
+    skim_path, manifest_path = skim_files(config_file, task)
+    if not os.path.exists(skim_path) or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest["source"] != histcache.HistogramCache.input_identity(task["inputs"]):
+        return None
+    if manifest["selection"] != json.loads(json.dumps(selection(config_file, task))):
+        return None
+    # the skim must contain every branch the current configuration reads
+    if not set(required_columns(config_file, task, manifest["source_columns"])) <= set(manifest["columns"]):
+        return None
+    return skim_path
+
+def use_valid_skims(config_file, tasks):
+    """Point task["files"] to the skim of every task that has a valid one."""
+    for task in tasks:
+        skim_path = valid_skim(config_file, task)
+        if skim_path:
+            print(f"[INFO] Reading skim {skim_path} for sample {task['label']}")
+            task["files"] = [skim_path]
+
+def make_skims(config_file, tasks):
+    """Write compressed Snapshot skims for every task that has no valid skim yet, all in one RunGraphs call."""
+    import ROOT
+    import booking
+    os.makedirs(config_file.skim_dir, exist_ok=True)
+    options = ROOT.RDF.RSnapshotOptions()
+    options.fLazy = True
+    options.fCompressionAlgorithm = ROOT.ROOT.RCompressionSetting.EAlgorithm.kZSTD
+    options.fCompressionLevel = 5
+
+    snapshots = []
+    manifests = {}
+    for task in tasks:
+        varied = varied_cut_columns(config_file, task)
+        if varied:
+            print(f"[WARNING] Not skimming sample {task['label']}: the cuts read the varied columns {varied}")
+            continue
+        if valid_skim(config_file, task):
+            print(f"[INFO] Skim for sample {task['label']} is up to date")
+            continue
+        skim_path, manifest_path = skim_files(config_file, task)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        df = ROOT.RDataFrame("Events", task["inputs"])
+        source_columns = [str(column) for column in df.GetColumnNames()]
+        columns = required_columns(config_file, task, source_columns)
+        print(f"[INFO] Skimming sample {task['label']}: keeping {len(columns)} of {len(source_columns)} branches")
+        node = booking.build_sample_graph(df, config_file, task["cuts"])
+        snapshots.append(node.Snapshot("Events", skim_path, columns, options))
+        manifests[manifest_path] = {
+            "source": histcache.HistogramCache.input_identity(task["inputs"]),
+            "selection": selection(config_file, task),
+            "source_columns": source_columns,
+            "columns": columns,
+        }
+
+    if snapshots:
+        ROOT.RDF.RunGraphs(snapshots)
+    # manifests are written last, an interrupted skim is never taken as valid
+    for manifest_path, manifest in manifests.items():
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+import histarrays
+
+def evaluate(expression, **columns):
+    nentries = len(next(iter(columns.values())))
+    return columnar.evaluate(expression, {name: np.asarray(values) for name, values in columns.items()}, nentries)
+
+@pytest.mark.parametrize("expression", ["1/2", "!x > y", "x & y", "x[0]", "x > 1 ? 1 : 0", "x < y < 3", "foo(x)"])
+def test_rejected_at_compile(expression):
+    with pytest.raises(ValueError):
+        columnar.compile_expression(expression)
+
+def test_integer_division_of_columns():
+    with pytest.raises(ValueError):
+        evaluate("njet/2", njet=[1, 2, 3])
+    assert evaluate("njet/2.", njet=[1, 2, 3]).tolist() == [0.5, 1.0, 1.5]
+
+def test_modulo():
+    with pytest.raises(ValueError):
+        evaluate("a % 2.0", a=[1.5, 2.5])
+    # C++ % truncates towards zero
+    assert evaluate("a % 2", a=[-3, 3]).tolist() == [-1, 1]
+
+def test_accepted():
+    x, y = np.array([1., 3., 5.]), np.array([2., 2., 2.])
+    assert evaluate("!(x > 2) && y < 3", x=x, y=y).tolist() == [True, False, False]
+    assert evaluate("x > 4 || !(y == 2)", x=x, y=y).tolist() == [False, False, True]
+    assert evaluate("std::abs(-x) + TMath::Sqrt(y * y)", x=x, y=y).tolist() == [3., 5., 7.]
+    assert evaluate("deltaR(x, x, y, y)", x=x, y=y).tolist() == [0., 0., 0.]
+    assert columnar.compile_expression("H_mass > 90 && !(ZZ_mass > 500)")[1] == {"H_mass", "ZZ_mass"}
+
+def test_find_bins_uniform():
+    hist = columnar.Histogram(["x", "x", "", 4, 0, 4])
+    values = np.array([-0.5, 0., 0.999, 1., 3.999, 4., 5., np.nan])
+    assert hist.find_bins(values).tolist() == [0, 1, 1, 2, 4, 5, 5, 5]
+
+def test_find_bins_variable():
+    hist = columnar.Histogram(["x", "x", "", [0, 1, 3, 6]])
+    values = np.array([-1., 0., 1., 2.999, 3., 5.9, 6., np.nan])
+    # a value on an inner edge belongs to the upper bin, like TAxis::FindFixBin
+    assert hist.find_bins(values).tolist() == [0, 1, 2, 2, 3, 3, 4, 4]
+
+def test_fill_and_fold():
+    hist = columnar.Histogram(["x", "x", "", 2, 0, 2])
+    hist.fill([-1., 0.5, 1.5, 2., 7.], [1., 2., 3., 4., 5.])
+    assert hist.sumw.tolist() == [1., 2., 3., 9.]
+    assert hist.sumw2.tolist() == [1., 4., 9., 41.]
+    histarrays.fold_arrays(hist.sumw, hist.sumw2, underflow=True, overflow=True)
+    assert hist.sumw.tolist() == [0., 3., 12., 0.]
+    assert hist.sumw2.tolist() == [0., 5., 50., 0.]
+
+def test_fold_batches():
+    sumw = np.arange(8.).reshape(2, 4)
+    sumw2 = sumw.copy()
+    histarrays.fold_arrays(sumw, sumw2)
+    assert sumw.tolist() == [[0., 1., 5., 0.], [4., 5., 13., 0.]]
+
+def test_root_and_uproot_stores_match(tmp_path):
+    pytest.importorskip("ROOT")
+    pytest.importorskip("uproot")
+    import benchmark
+    args = argparse.Namespace(workdir=str(tmp_path), events=500, samples=2, data=True)
+    report = benchmark.compare_engines(args)
+    assert report["histograms_compared"] > 0
+    assert report["mismatches"] == 0
@@ -0,0 +1,45 @@
+import os
+import sys
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+pytest.importorskip("cmsstyle")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+import fillspec
+import histstore
+import render
+
+def make_store(config_file, path):
+    """Synthetic store with two MC samples and data for every configured variable."""
+    ROOT.gRandom.SetSeed(1)
+    histos = {}
+    for variable in config_file.vars:
+        for label, scale in [("ggH", 0.5), ("qqZZ", 1.5), (fillspec.DATA_NAME, 1.0)]:
+            hist = ROOT.TH1D(f"{variable[1]}_{label}", "", variable[3], variable[4], variable[5])
+            hist.SetDirectory(0)
+            hist.Sumw2()
+            for _ in range(2000):
+                hist.Fill(ROOT.gRandom.Gaus(200, 60), scale if label != fillspec.DATA_NAME else 1.0)
+            histos[(variable[1], label)] = hist
+    histstore.write_histograms(path, histos)
+
+def render_to(config_file, store_path, output_dir, jobs):
+    config_file.output_plots_dir = str(output_dir)
+    render.render_plots(config_file, store_path, "stack", jobs=jobs, rebuild=True)
+    plot_dir = os.path.join(str(output_dir), "stack")
+    return {name: open(os.path.join(plot_dir, name), "rb").read() for name in sorted(os.listdir(plot_dir)) if name.endswith(".png")}
+
+def test_parallel_render_matches_serial(tmp_path):
+    config_file = config.Config()
+    config_file.plot_format = "png"
+    config_file.add_sample(name="ggH", root_file="ggH.root", cuts=1)
+    config_file.add_sample(name="qqZZ", root_file="qqZZ.root", cuts=1)
+    store_path = str(tmp_path / "histograms.root")
+    make_store(config_file, store_path)
+
+    serial = render_to(config_file, store_path, tmp_path / "serial", jobs=1)
+    parallel = render_to(config_file, store_path, tmp_path / "parallel", jobs=3)
+    assert serial and list(serial) == list(parallel)
+    assert [name for name in serial if serial[name] != parallel[name]] == []
@@ -1,4 +1,6 @@
+import array
 import math
+import re
 
 def add_underflow(h):
     e1 = h.GetBinError(1)
@@ -17,4 +19,64 @@ def add_overflow(h):
     h.SetBinError(nbins-1, math.sqrt(e1*e1 + e2*e2))
     h.SetBinContent(nbins, 0)
     h.SetBinError(nbins, 0)
-    return h
\ No newline at end of file
+    return h
+
+def histo1d_model(name, variable):
+    import ROOT
+    ## variable = [branch name, plot name, x-axis label, nbins, xlow, xhigh]
+    if isinstance(variable[3], list):  # Variable binning
+        return ROOT.RDF.TH1DModel(name, "", len(variable[3]) - 1, array.array("d", variable[3]))
+    return ROOT.RDF.TH1DModel(name, "", variable[3], variable[4], variable[5])
+
+def axis_edges(axis):
+    ## axis = [expression, axis label, nbins, xlow, xhigh] or [expression, axis label, [bin edges]]
+    if isinstance(axis[2], list):  # Variable binning
+        return [float(edge) for edge in axis[2]]
+    nbins, xlow, xhigh = axis[2], axis[3], axis[4]
+    return [xlow + (xhigh - xlow) * i / nbins for i in range(nbins + 1)]
+
+def histond_model(name, spec):
+    import ROOT
+    ## every axis is given by its edges so that uniform and variable binning can be mixed
+    edges = [axis_edges(axis) for axis in spec["axes"]]
+    title = ";" + ";".join(axis[1] for axis in spec["axes"])
+    if len(edges) == 2:
+        return ROOT.RDF.TH2DModel(name, title, len(edges[0]) - 1, array.array("d", edges[0]), len(edges[1]) - 1, array.array("d", edges[1]))
+    if len(edges) == 3:
+        return ROOT.RDF.TH3DModel(name, title, len(edges[0]) - 1, array.array("d", edges[0]), len(edges[1]) - 1, array.array("d", edges[1]), len(edges[2]) - 1, array.array("d", edges[2]))
+    xbins = ROOT.std.vector["std::vector<double>"]()
+    for axis_bins in edges:
+        xbins.push_back(ROOT.std.vector["double"](axis_bins))
+    return ROOT.RDF.THnDModel(name, title, len(edges), [len(axis_bins) - 1 for axis_bins in edges], xbins)
+
+def report_event_loops(rdf_dict):
+    """Print how many event loops each RDataFrame has run, every input should be read once. Returns the total."""
+    print("[INFO] Event loop summary:")
+    total = 0
+    for label, df in rdf_dict.items():
+        nruns = df.GetNRuns()
+        print(f"  {label}: {nruns} event loop(s)")
+        if nruns != 1:
+            print(f"[WARNING] {label} was read {nruns} times, expected exactly once")
+        total += nruns
+    return total
+
+def referenced_columns(expressions, columns):
+    """Columns of the input tree that appear as identifiers in any of the expressions."""
+    identifiers = set()
+    for expression in expressions:
+        identifiers.update(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", str(expression)))
+    return sorted(identifiers & set(columns))
+
+def branch_zip_bytes(input_paths, expressions):
+    """Compressed size of the branches the expressions read, summed over the input files."""
+    import ROOT
+    total = 0
+    for path in input_paths:
+        tfile = ROOT.TFile.Open(path, "READ")
+        tree = tfile.Get("Events")
+        branches = [branch.GetName() for branch in tree.GetListOfBranches()]
+        for name in referenced_columns(expressions, branches):
+            total += tree.GetBranch(name).GetZipBytes("*")
+        tfile.Close()
+    return total